@@ -0,0 +1,30 @@
+"""
+Rebuilds the local follows/blocks tables from the user service. run it once 
+before setting SOCIAL_GRAPH_SOURCE=local (with the API already consuming 
+user events) and again whenever the event listener reports a gap
+
+    cd app
+    python backfill_graph.py
+"""
+import asyncio
+from core.communications import request_manager, response_manager
+from core.cache import redis_client
+from services import social_graph
+
+
+async def main():
+    await response_manager.startup()
+    await request_manager.startup()
+    await redis_client.ping()
+
+    try:
+        result = await social_graph.backfill()
+        print(f'backfill done: {result}')
+    finally:
+        await response_manager.shutdown()
+        await request_manager.shutdown()
+        await redis_client.aclose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
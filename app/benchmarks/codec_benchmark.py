@@ -0,0 +1,51 @@
+"""
+Micro-benchmark of the kafka message codecs (core/codecs.py) on a followers 
+response, for every installed codec and compression
+
+    cd app
+    python -m benchmarks.codec_benchmark --followers 50000
+"""
+import argparse
+import time
+import uuid
+
+from core.codecs import CODECS, COMPRESSIONS, MessageCodec
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--followers', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    message = {
+        "request_id": str(uuid.uuid4()),
+        "status": "200",
+        "followers": [str(uuid.uuid4()) for _ in range(args.followers)],
+    }
+
+    print(f'followers response with {args.followers} ids, best of {args.repeat}')
+    print(f'{"codec":<10}{"compression":<13}{"bytes":>12}{"encode ms":>12}{"decode ms":>12}')
+
+    for codec in CODECS:
+        for compression in [None, *COMPRESSIONS]:
+            message_codec = MessageCodec(codec, compression)
+            value, headers = message_codec.encode(message)
+            assert MessageCodec.decode(value, headers) == message
+
+            encode = best_of(lambda: message_codec.encode(message), args.repeat)
+            decode = best_of(lambda: MessageCodec.decode(value, headers), args.repeat)
+            print(f'{codec:<10}{compression or "-":<13}{len(value):>12,}{encode * 1000:>12.2f}{decode * 1000:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
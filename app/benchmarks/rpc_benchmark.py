@@ -0,0 +1,97 @@
+"""
+Offline benchmark of the user-service RPC path (core/communications.py) over 
+the in memory transport and a scripted responder, no kafka or user service needed
+
+    cd app
+    python -m benchmarks.rpc_benchmark --requests 5000 --concurrency 200 --latency-ms 2 --jitter-ms 3
+    python -m benchmarks.rpc_benchmark --batching --drop-rate 0.01 --timeout 0.5
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from core.communications import FollowersRequestManager, FollowersResponseManager, UserServiceClient
+from core.transport import InMemoryBroker, InMemoryTransport, ScriptedResponder
+
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    broker = InMemoryBroker()
+    responder = ScriptedResponder(
+        broker,
+        follower_count=args.followers,
+        # fixed latency plus exponential jitter, for a long tail
+        latency=lambda: (args.latency_ms + rng.expovariate(1 / args.jitter_ms) if args.jitter_ms else args.latency_ms) / 1000,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+    response_manager = FollowersResponseManager(transport=InMemoryTransport(broker))
+    request_manager = FollowersRequestManager(transport=InMemoryTransport(broker), responses=response_manager)
+    for manager in (responder, request_manager, response_manager):
+        await manager.startup()
+
+    client = UserServiceClient(
+        request_manager, response_manager, 
+        batching=args.batching, linger=args.linger_ms / 1000, max_keys=args.max_keys,
+    )
+
+    latencies = []
+    failed = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def lookup(i):
+        nonlocal failed
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.call('request-followers', f'user-{i % args.users}', timeout=args.timeout)
+            if response is None:
+                failed += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[lookup(i) for i in range(args.requests)])
+    elapsed = time.perf_counter() - start
+
+    for manager in (responder, request_manager, response_manager):
+        await manager.shutdown()
+
+    ms = [t * 1000 for t in latencies]
+    print(f'requests      {args.requests} ({"batched" if args.batching else "single"}), concurrency {args.concurrency}')
+    print(f'elapsed       {elapsed:.3f}s, {args.requests / elapsed:,.0f} lookups/s')
+    print(f'messages      {len(responder.received)} requests, {responder.dropped} dropped, {failed} lookups failed')
+    if ms:
+        print(
+            f'latency ms    mean {statistics.mean(ms):.2f}  p50 {percentile(ms, .5):.2f}  '
+            f'p95 {percentile(ms, .95):.2f}  p99 {percentile(ms, .99):.2f}  max {max(ms):.2f}'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--users', type=int, default=1000, help='distinct user ids looked up')
+    parser.add_argument('--followers', type=int, default=100, help='followers in each reply')
+    parser.add_argument('--latency-ms', type=float, default=1, help='responder latency')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='mean of exponential extra latency')
+    parser.add_argument('--drop-rate', type=float, default=0, help='share of requests never answered')
+    parser.add_argument('--timeout', type=float, default=1)
+    parser.add_argument('--batching', action='store_true')
+    parser.add_argument('--linger-ms', type=float, default=5)
+    parser.add_argument('--max-keys', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
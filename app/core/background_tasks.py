@@ -1,66 +1,115 @@
-from models import post as models
+from models import post as models, interaction as iModels
 from db.database import SessionLocal  
-import uuid
-from core.notifications import notifications
-from core.communications import request_manager, response_manager
+from sqlalchemy import select, update, func, or_
+from core.notifications import notifications, notification_aggregator
 from core.cache import redis_client
-import json
+from core.counters import view_counter, unique_viewers
+from core.timelines import timelines
+from models.outbox import OutboxEvent
+from services import user_service
+from typing import List
 
-async def increment_views( post_id: str ):
-    db = SessionLocal()
+async def increment_views( post_id: str, author_id: str, viewer: str ):
+    # buffered in redis, flushed to the database by view_counter.flush
+    await view_counter.incr(post_id)
+    await unique_viewers.add(post_id, author_id, viewer)
 
-    try:
-        post = db.query(models.Post).filter(
-            models.Post.id == uuid.UUID(post_id),
-            models.Post.soft_delete == False,
-        ).first()
+async def reconcile_post_counters(batch_size: int = 1000):
+    """
+    Repairs drift of the denormalized likes/comments/bookmarks counters of posts,
+    recounting one batch of posts per statement
+    """
+    likes = (
+        select(func.count(iModels.Like.id))
+        .where(iModels.Like.post_id == models.Post.id)
+        .scalar_subquery()
+    )
+    comments = (
+        select(func.count(iModels.Comment.id))
+        .where(iModels.Comment.post_id == models.Post.id, iModels.Comment.soft_delete == False)
+        .scalar_subquery()
+    )
+    bookmarks = (
+        select(func.count(iModels.Bookmark.id))
+        .where(iModels.Bookmark.post_id == models.Post.id)
+        .scalar_subquery()
+    )
 
-        if post:
-            post.views += 1
-            db.commit()
-            
-    finally:
-        db.close()
+    repaired = 0
+    last_id = None
+    async with SessionLocal() as db:
+        while True:
+            q = select(models.Post.id).order_by(models.Post.id).limit(batch_size)
+            if last_id is not None:
+                q = q.where(models.Post.id > last_id)
 
-async def notify_new_post(post_id: str, author_id:str):
-    """Called when someone comments"""
-
-    key = f'followers:{author_id}'
-    cached = await redis_client.get(key)
+            post_ids = (await db.scalars(q)).all()
+            if not post_ids:
+                break
+            last_id = post_ids[-1]
 
-    # cached == follower_ids
-    if cached:
-        await notifications.notify_users(
-                    json.loads(cached),
-                    "new_post",
-                    {
-                        "user_id": str(author_id),
-                        "post_id": post_id,
-                        "type": "post"
-                    }
-                )
-    else:
-        correlation_id = await request_manager.request_data(author_id, 'request-followers')
-        
-        if correlation_id:
-            response = await response_manager.wait_for_response(correlation_id, timeout=30)
-
-            if response:
-                follower_ids = response['followers']
-
-                await redis_client.setex(key, 60*5, json.dumps(follower_ids))
-                
-                await notifications.notify_users(
-                    follower_ids,
-                    "new_post",
-                    {
-                        "user_id": str(author_id),
-                        "post_id": post_id,
-                        "type": "post"
-                    }
+            result = await db.execute(
+                update(models.Post)
+                .where(
+                    models.Post.id.in_(post_ids),
+                    or_(
+                        models.Post.likes_count != likes,
+                        models.Post.comments_count != comments,
+                        models.Post.bookmarks_count != bookmarks,
+                    )
                 )
+                .values(likes_count=likes, comments_count=comments, bookmarks_count=bookmarks)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            repaired += result.rowcount
+
+    if repaired:
+        print(f'reconcile_post_counters: repaired {repaired} posts')
+
+async def notify_new_post(post_id: str, author_id:str, created_at: float):
+    """Called when someone creates a post, fans it out to followers' timelines"""
+
+    # raises when the followers are unknown, the outbox retries the event
+    follower_ids = await user_service.require_followers(author_id)
+
+    # the author sees their own posts in their feed too
+    await timelines.fan_out(post_id, created_at, [*follower_ids, str(author_id)])
+
+    if follower_ids:
+        progress = await notifications.notify_users(
+            follower_ids, "new_post", _new_post_data(post_id, author_id)
+        )
+        if progress.failed:
+            print(f'new post {post_id}: {progress.failed}/{progress.total} notifications failed')
+
+            # only the followers that were missed are retried, by the outbox
+            async with SessionLocal() as db:
+                db.add(OutboxEvent(
+                    event_type='new_post_notifications',
+                    payload={
+                        "post_id": post_id, 
+                        "author_id": str(author_id), 
+                        "follower_ids": progress.failed_user_ids,
+                    },
+                ))
+                await db.commit()
+
+async def notify_followers(post_id: str, author_id: str, follower_ids: List[str]):
+    """Sends the new_post notifications notify_new_post failed to send, raises until they all went out"""
+    progress = await notifications.notify_users(
+        follower_ids, "new_post", _new_post_data(post_id, author_id)
+    )
+    if progress.failed:
+        raise RuntimeError(f'new post {post_id}: {progress.failed}/{progress.total} notifications failed')
+
+def _new_post_data(post_id: str, author_id: str) -> dict:
+    return {
+        "user_id": str(author_id),
+        "post_id": post_id,
+        "type": "post"
+    }
 
-# To Do: cache likes to prevent repeating notifications
 async def notify_post_liked(post_id: str, liker_id: str, author_id: str):
     """Called when someone likes a post"""
 
@@ -72,9 +121,12 @@ async def notify_post_liked(post_id: str, liker_id: str, author_id: str):
         if author_id != liker_id:  # Don't notify self
             await redis_client.setex(key, 60*60*24, 1)
 
-            await notifications.notify_user(
+            # likes of the same post within a short window go out as one notification
+            await notification_aggregator.add(
                 author_id,
                 "post_liked",
+                post_id,
+                liker_id,
                 {
                     "post_id": post_id,
                     "liker_id": liker_id,
@@ -82,13 +134,14 @@ async def notify_post_liked(post_id: str, liker_id: str, author_id: str):
                 }
             )
 
-# To Do: cache comments to prevent repeating notifications
 async def notify_new_comment(post_id: str, commenter_id: str, author_id: str, comment: str):
     """Called when someone comments"""
     if str(author_id) != commenter_id:
-        await notifications.notify_user(
+        await notification_aggregator.add(
             str(author_id),
             "new_comment",
+            post_id,
+            commenter_id,
             {
                 "post_id": post_id,
                 "commenter_id": commenter_id,
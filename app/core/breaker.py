@@ -0,0 +1,46 @@
+import time
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency: after `max_failures` failures in a row 
+    the circuit opens for `reset_timeout` seconds, then one trial call is let 
+    through (half open) and its outcome closes or reopens it
+    """
+
+    def __init__(self, name: str, max_failures: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+        self.trial = False
+        if self.opened_at is not None or self.failures >= self.max_failures:
+            if self.opened_at is None:
+                print(f'circuit {self.name} opened after {self.failures} failures')
+            self.opened_at = time.monotonic()
@@ -20,6 +20,18 @@ redis_client = redis.from_url(
 async def get_redis() -> AsyncGenerator[redis.Redis, None]:
     yield redis_client
 
+# cached /stats/ response of a user
+STATS_TTL = int(os.environ.get('STATS_CACHE_TTL', 60*5))
+
+def stats_key(user_id) -> str:
+    return f'stats:{user_id}'
+
+async def invalidate_user_stats(*user_ids):
+    """Drops the cached stats of users whose posts or interactions changed"""
+    keys = [stats_key(pk) for pk in user_ids if pk]
+    if keys:
+        await redis_client.delete(*keys)
+
 async def cache(ttl: int = 60*15):  # 15 min default
     def decorator(func: Callable) -> Callable:
         @functools.wraps(func)
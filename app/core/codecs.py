@@ -0,0 +1,165 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# optional, a codec/compression is only usable when its package is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CONTENT_TYPE_HEADER = 'content-type'
+CONTENT_ENCODING_HEADER = 'content-encoding'
+
+# msgpack extension type of a uuid list packed as 16 bytes per id. no longer 
+# sent, building the id strings back costs several times the decode of plain 
+# strings; still read from senders that packed them
+UUID_LIST_EXT = 1
+
+
+def unpack_uuid_list(data: bytes) -> List[str]:
+    h = data.hex()
+    return [
+        f'{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}'
+        for i in range(0, len(h), 32)
+    ]
+
+
+class Codec(ABC):
+    name: str
+
+    @abstractmethod
+    def dumps(self, obj) -> bytes:
+        ...
+
+    @abstractmethod
+    def loads(self, data: bytes):
+        ...
+
+
+class JsonCodec(Codec):
+    """The stdlib json the services always used, messages without headers are json"""
+    name = 'json'
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+    def loads(self, data: bytes):
+        return json.loads(data.decode())
+
+
+class OrjsonCodec(Codec):
+    """Same wire format as json, several times faster"""
+    name = 'orjson'
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data: bytes):
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """Binary, smaller than json; ids stay strings (compression shrinks them)"""
+    name = 'msgpack'
+
+    @staticmethod
+    def _ext_hook(code: int, data: bytes):
+        if code == UUID_LIST_EXT:
+            return unpack_uuid_list(data)
+        return msgpack.ExtType(code, data)
+
+    def dumps(self, obj) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes):
+        return msgpack.unpackb(data, raw=False, ext_hook=self._ext_hook)
+
+
+CODECS: Dict[str, Codec] = {
+    codec.name: codec
+    for codec, module in ((JsonCodec(), json), (OrjsonCodec(), orjson), (MsgpackCodec(), msgpack))
+    if module is not None
+}
+
+# name -> (compress, decompress)
+COMPRESSIONS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {}
+if lz4 is not None:
+    COMPRESSIONS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+if zstandard is not None:
+    COMPRESSIONS['zstd'] = (
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+
+class MessageCodec:
+    """
+    Encodes messages with the configured codec and compression and names both
+    in the message headers; decoding follows the headers of each message,
+    so senders on old and new formats can coexist
+    """
+
+    def __init__(self, codec: str = 'json', compression: Optional[str] = None, min_compress_size: int = 1024):
+        if codec not in CODECS:
+            raise ValueError(f'codec {codec} is not available, install its package (available: {", ".join(CODECS)})')
+        if compression and compression not in COMPRESSIONS:
+            raise ValueError(f'compression {compression} is not available, install its package')
+
+        self.codec = CODECS[codec]
+        self.compression = compression or None
+        # small messages are not worth the compression header and cpu
+        self.min_compress_size = min_compress_size
+
+    def encode(self, obj) -> Tuple[bytes, List[Tuple[str, bytes]]]:
+        data = self.codec.dumps(obj)
+        headers = [(CONTENT_TYPE_HEADER, self.codec.name.encode())]
+
+        if self.compression and len(data) >= self.min_compress_size:
+            data = COMPRESSIONS[self.compression][0](data)
+            headers.append((CONTENT_ENCODING_HEADER, self.compression.encode()))
+
+        return data, headers
+
+    @staticmethod
+    def decode(data: bytes, headers: Sequence[Tuple[str, bytes]] = ()):
+        headers = dict(headers or ())
+
+        encoding = headers.get(CONTENT_ENCODING_HEADER)
+        if encoding:
+            encoding = encoding.decode()
+            if encoding not in COMPRESSIONS:
+                raise ValueError(f'message compressed with {encoding}, which is not available')
+            data = COMPRESSIONS[encoding][1](data)
+
+        content_type = headers.get(CONTENT_TYPE_HEADER)
+        content_type = content_type.decode() if content_type else 'json'
+        if content_type not in CODECS:
+            raise ValueError(f'message encoded with {content_type}, which is not available')
+        return CODECS[content_type].loads(data)
+
+    @staticmethod
+    def content_type(headers: Sequence[Tuple[str, bytes]] = ()) -> Tuple[str, Optional[str]]:
+        """codec and compression a message was sent with, to answer in kind"""
+        headers = dict(headers or ())
+        content_type = headers.get(CONTENT_TYPE_HEADER)
+        encoding = headers.get(CONTENT_ENCODING_HEADER)
+        return (
+            content_type.decode() if content_type else 'json',
+            encoding.decode() if encoding else None,
+        )
@@ -1,62 +1,135 @@
-from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
-import os, json, uuid, time
-from typing import Dict, Optional
+from core.transport import Transport, KafkaTransport
+from core.codecs import MessageCodec
+import os, uuid, time, socket
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
 from dotenv import load_dotenv
 import asyncio
 
 load_dotenv()
 
+# identifies this process in the replies it asks for
+INSTANCE_ID = os.environ.get('INSTANCE_ID') or f'{socket.gethostname()}-{uuid.uuid4().hex[:8]}'
+
+# optional topic only this instance reads its replies from, when empty replies 
+# come on the shared response topics and are filtered by the reply-to header
+REPLY_TOPIC = os.environ.get('KAFKA_REPLY_TOPIC', '')
+
+REPLY_TO_HEADER = 'reply-to'
+
+RESPONSE_TOPICS = ['response-followers', 'response-blocked-users']
+
+# format of the requests, replies are decoded by their own headers (core/codecs.py)
+message_codec = MessageCodec(
+    codec=os.environ.get('KAFKA_CODEC', 'json'),
+    compression=os.environ.get('KAFKA_COMPRESSION') or None,
+)
+
+# producer batching, see FollowersRequestManager.pipelined
+KAFKA_PRODUCER = {
+    'linger_ms': int(os.environ.get('KAFKA_LINGER_MS', 5)),
+    'max_batch_size': int(os.environ.get('KAFKA_MAX_BATCH_SIZE', 64*1024)),
+}
+
 class FollowersRequestManager:
-    def __init__(self):
-        self.producer = None
+    def __init__(
+        self, 
+        transport: Optional[Transport] = None, 
+        codec: MessageCodec = message_codec,
+        responses: Optional["FollowersResponseManager"] = None,
+        pipelined: bool = True,
+    ):
+        # kafka unless another transport is given (e.g. in memory, core/transport.py)
+        self.transport = transport
+        self.codec = codec
+        # pipelined: requests are queued without waiting for the broker's ack, 
+        # a failed delivery fails the request's waiter (in `responses`) instead
+        self.responses = responses
+        self.pipelined = pipelined and responses is not None
 
     async def startup(self):
-        self.producer = AIOKafkaProducer(
-            bootstrap_servers=os.environ.get('KAFKA_URL', None),
-            key_serializer=lambda k: str(k).encode('utf-8'),
-            value_serializer=lambda v: json.dumps(v).encode('utf-8'),
-            compression_type='gzip'
-        )
-        await self.producer.start()
+        if self.transport is None:
+            # messages the codec compresses are not compressed again by the producer
+            self.transport = KafkaTransport(
+                compression_type=None if self.codec.compression else 'gzip',
+                **KAFKA_PRODUCER,
+            )
+        await self.transport.start_producer()
 
     async def shutdown(self):
         """Called on FastAPI shutdown"""
-        if self.producer:
-            await self.producer.stop()
+        if self.transport:
+            await self.transport.stop()
 
     async def request_data(self, user_id: str, topic: str):
         if not topic in ['request-followers', 'request-blocked-users']:
             return None
         
+        return await self._send(topic, {"user_id": user_id})
+
+    async def request_batch(self, user_ids: List[str], topic: str):
+        """One message for many users, answered with a `results` dict by user id"""
+        if not topic in ['request-followers', 'request-blocked-users']:
+            return None
+        
+        return await self._send(topic, {"user_ids": user_ids})
+
+    async def _send(self, topic: str, body: dict) -> str:
         correlation_id = str(uuid.uuid4())
 
+        # the user service copies the reply-to header to its response 
+        # (and sends it to reply_topic when there is one)
         message = {
             "request_id": correlation_id,
-            "user_id": user_id,
+            **body,
+            "reply_to": INSTANCE_ID,
+            "reply_topic": REPLY_TOPIC or None,
             "timestamp": time.time()
         }
 
-        await self.producer.send_and_wait(
+        value, headers = self.codec.encode(message)
+
+        delivery = await self.transport.enqueue(
             topic, 
-            key=correlation_id,
-            value=message
+            correlation_id,
+            value,
+            headers=[(REPLY_TO_HEADER, INSTANCE_ID.encode()), *headers],
         )
 
+        if self.pipelined:
+            delivery.add_done_callback(lambda f: self._delivered(correlation_id, f))
+        else:
+            await delivery
+
         return correlation_id
 
+    def _delivered(self, correlation_id: str, delivery: asyncio.Future):
+        error = asyncio.CancelledError() if delivery.cancelled() else delivery.exception()
+        if error is not None:
+            print(f'request {correlation_id} was not delivered: {error!r}')
+            self.responses.fail(correlation_id, error)
+
 class FollowersResponseManager:
-    def __init__(self):
-        self.responses: Dict[str, dict] = {}
-        self.consumer = None
+    """
+    Hands kafka responses to their waiters: every waiting request has a future 
+    by correlation id, resolved by the consumer as soon as the response arrives.
+    responses nobody waits for (yet) are kept for `unclaimed_ttl` seconds
+    """
+    def __init__(self, unclaimed_ttl: float = 60, max_unclaimed: int = 10000, transport: Optional[Transport] = None):
+        self.pending: Dict[str, asyncio.Future] = {}
+        # correlation id -> (arrival time, response or delivery error), oldest first
+        self.unclaimed: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.unclaimed_ttl = unclaimed_ttl
+        self.max_unclaimed = max_unclaimed
+        self.transport = transport
         self.consumer_task = None
 
     async def startup(self):
-        self.consumer = AIOKafkaConsumer(
-            bootstrap_servers=os.environ.get("KAFKA_URL", ''),
-            value_deserializer=lambda v: json.loads(v.decode()),
-        )
-        self.consumer.subscribe(['response-followers', 'response-blocked-users'])
-        await self.consumer.start()
+        if self.transport is None:
+            self.transport = KafkaTransport()
+
+        # values are decoded in _handle, only for replies of this instance
+        await self.transport.subscribe([REPLY_TOPIC] if REPLY_TOPIC else RESPONSE_TOPICS)
 
         self.consumer_task = asyncio.create_task(self._consume_responses())
 
@@ -65,23 +138,188 @@ class FollowersResponseManager:
         if self.consumer_task:
             self.consumer_task.cancel()
 
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
     async def _consume_responses(self):
         try:
-            async for msg in self.consumer:
-                correlation_id = msg.key.decode()
-                self.responses[correlation_id] = msg.value
+            async for msg in self.transport:
+                try:
+                    self._handle(msg.key, msg.headers, msg.value)
+                except Exception as e:
+                    # one undecodable reply must not stop the consumer, its waiter times out
+                    print(f'skipped response {msg.key!r} on {msg.topic}: {e!r}')
         finally:
-            await self.consumer.stop()
+            await self.transport.stop()
+
+    def _handle(self, key: Optional[bytes], headers, value: bytes):
+        if key is None:
+            return
+
+        # replies to other instances are skipped without decoding them, 
+        # replies without the header come from an older user service
+        reply_to = dict(headers or ()).get(REPLY_TO_HEADER)
+        if reply_to is not None and reply_to.decode() != INSTANCE_ID:
+            return
+
+        self._resolve(key.decode(), MessageCodec.decode(value, headers))
+
+    def fail(self, correlation_id: str, error: BaseException):
+        """The request was never delivered, its waiter gets the error"""
+        future = self.pending.get(correlation_id)
+        if future is not None and not future.done():
+            future.set_exception(error)
+            return
+
+        self.unclaimed[correlation_id] = (time.monotonic(), error)
+        self._evict()
+
+    def _resolve(self, correlation_id: str, response: dict):
+        future = self.pending.get(correlation_id)
+        if future is not None and not future.done():
+            future.set_result(response)
+            return
+
+        # arrived before its waiter, or after it timed out
+        self.unclaimed[correlation_id] = (time.monotonic(), response)
+        self._evict()
+
+    def _evict(self):
+        expire_before = time.monotonic() - self.unclaimed_ttl
+        while self.unclaimed:
+            correlation_id, (arrived, _) = next(iter(self.unclaimed.items()))
+            if arrived > expire_before and len(self.unclaimed) <= self.max_unclaimed:
+                break
+            del self.unclaimed[correlation_id]
 
     async def wait_for_response(self, correlation_id: str, timeout: float = 15.0) -> Optional[dict]:
-        start = asyncio.get_event_loop().time()
-        while asyncio.get_event_loop().time() - start < timeout:
-            if correlation_id in self.responses:
-                return self.responses.pop(correlation_id)
-            
-            await asyncio.sleep(0.1)
-        return None
+        self._evict()
+        if correlation_id in self.unclaimed:
+            response = self.unclaimed.pop(correlation_id)[1]
+            if isinstance(response, BaseException):
+                raise response
+            return response
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[correlation_id] = future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(correlation_id, None)
+
+class BatchingRequests:
+    """
+    Collects lookups of a topic for `linger` seconds (or until `max_keys` users) 
+    and sends them as one batch message, the batch response is split back 
+    to the callers. the batch waits as long as its most patient caller, each 
+    caller gives up after its own timeout
+    """
+    def __init__(
+        self, 
+        request_manager: FollowersRequestManager, 
+        response_manager: FollowersResponseManager, 
+        linger: float = 0.005, 
+        max_keys: int = 100,
+    ):
+        self.request_manager = request_manager
+        self.response_manager = response_manager
+        self.linger = linger
+        self.max_keys = max_keys
+        # topic -> user id -> waiting callers
+        self.batches: Dict[str, Dict[str, List[asyncio.Future]]] = {}
+        # topic -> longest timeout of the batch's callers
+        self.timeouts: Dict[str, float] = {}
+        self.timers: Dict[str, asyncio.TimerHandle] = {}
+        self.sending = set()
+
+    async def call(self, topic: str, user_id: str, timeout: float) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self.batches.setdefault(topic, {})
+        batch.setdefault(str(user_id), []).append(future)
+        self.timeouts[topic] = max(self.timeouts.get(topic, 0), timeout)
+
+        if len(batch) >= self.max_keys:
+            self._flush(topic)
+        elif topic not in self.timers:
+            self.timers[topic] = loop.call_later(self.linger, self._flush, topic)
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _flush(self, topic: str):
+        timer = self.timers.pop(topic, None)
+        if timer:
+            timer.cancel()
+
+        batch = self.batches.pop(topic, None)
+        timeout = self.timeouts.pop(topic, 0)
+        if batch:
+            task = asyncio.create_task(self._send(topic, batch, timeout))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def _send(self, topic: str, batch: Dict[str, List[asyncio.Future]], timeout: float):
+        results = {}
+        try:
+            correlation_id = await self.request_manager.request_batch(list(batch), topic)
+            if correlation_id:
+                reply = await self.response_manager.wait_for_response(correlation_id, timeout=timeout)
+                results = (reply or {}).get('results') or {}
+        except Exception as e:
+            print(f'batch request to {topic} failed: {e}')
+        finally:
+            for user_id, futures in batch.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(results.get(user_id))
+
+
+class UserServiceClient:
+    """
+    Request/response calls to the user service, one message per lookup or 
+    batched when `batching` is on (the user service must answer `user_ids`
+    requests with `results`)
+    """
+    def __init__(
+        self, 
+        request_manager: FollowersRequestManager, 
+        response_manager: FollowersResponseManager, 
+        batching: bool = False, 
+        linger: float = 0.005, 
+        max_keys: int = 100,
+    ):
+        self.request_manager = request_manager
+        self.response_manager = response_manager
+        self.batcher = BatchingRequests(request_manager, response_manager, linger, max_keys) if batching else None
+
+    async def call(self, topic: str, user_id: str, timeout: float = 30) -> Optional[dict]:
+        if self.batcher:
+            return await self.batcher.call(topic, user_id, timeout)
+
+        correlation_id = await self.request_manager.request_data(user_id, topic)
+        if not correlation_id:
+            return None
+
+        return await self.response_manager.wait_for_response(correlation_id, timeout=timeout)
+
 
 # Global instance
-request_manager = FollowersRequestManager()
-response_manager = FollowersResponseManager()
\ No newline at end of file
+response_manager = FollowersResponseManager()
+request_manager = FollowersRequestManager(
+    responses=response_manager,
+    pipelined=os.environ.get('KAFKA_PIPELINED', 'true').lower() in ('1', 'true', 'yes'),
+)
+user_rpc = UserServiceClient(
+    request_manager,
+    response_manager,
+    batching=os.environ.get('USER_RPC_BATCHING', 'false').lower() in ('1', 'true', 'yes'),
+    linger=float(os.environ.get('USER_RPC_LINGER_MS', 5)) / 1000,
+    max_keys=int(os.environ.get('USER_RPC_MAX_KEYS', 100)),
+)
\ No newline at end of file
@@ -3,13 +3,22 @@ import json, uuid
 from core.cache import redis_client
 from db.database import SessionLocal
 from models.post import UserReference
-from datetime import datetime, timezone
+from services import social_graph
+from sqlalchemy import select
+from models.base import utcnow
 
 class UserEventManager:
+    # follow/block changes: event type -> (handler, ids of the edge in the event data)
+    EDGE_EVENTS = {
+        'follow': (social_graph.follow, 'follower_id', 'followee_id'),
+        'unfollow': (social_graph.unfollow, 'follower_id', 'followee_id'),
+        'block': (social_graph.block, 'blocker_id', 'blocked_id'),
+        'unblock': (social_graph.unblock, 'blocker_id', 'blocked_id'),
+    }
+
     def __init__(self):
         self.redis = redis_client
         self.task = None
-        self.db = SessionLocal()
 
     async def startup(self):
         self.task = asyncio.create_task(self.listen_to_redis())
@@ -23,62 +32,85 @@ class UserEventManager:
         async with self.redis.pubsub() as pubsub:
             await pubsub.subscribe(f'user_events')
             while True:
-                message = await pubsub.get_message(ignore_subscribe_messages=True)
+                try:
+                    # waits for the next message, the timeout only lets cancellation in
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # events published while disconnected are lost, the local
+                    # follows/blocks need a backfill (backfill_graph.py)
+                    print('user events connection lost, run backfill_graph.py to resync : ', e)
+                    await asyncio.sleep(1)
+                    continue
+
                 if message:
-                    dump = json.loads(message['data'])
-                    _data = dump['data']
-                    _type = dump['type']
-
-                    if _type == 'create':
-                        await self._handle_create(_data)
-                    elif _type == 'update':
-                        await self._handle_update(_data)
-                    elif _type == 'delete':
-                        await self._handle_delete(_data)
-                    
-                await asyncio.sleep(1)
+                    try:
+                        await self._handle_message(message['data'])
+                    except Exception as e:
+                        print('user event exception : ', e)
+
+    async def _handle_message(self, data: str):
+        dump = json.loads(data)
+        _data = dump['data']
+        _type = dump['type']
+
+        if _type == 'create':
+            await self._handle_create(_data)
+        elif _type == 'update':
+            await self._handle_update(_data)
+        elif _type == 'delete':
+            await self._handle_delete(_data)
+        elif _type in self.EDGE_EVENTS:
+            await self._handle_edge(_type, _data)
+
+    async def _get_user(self, db, user_id: uuid.UUID):
+        return (await db.scalars(
+            select(UserReference).where(
+                UserReference.user_id == user_id
+            )
+        )).first()
 
     async def _handle_create(self, user_data: dict):
         try:
             user_id = uuid.UUID(user_data['id'])
 
-            existing_user = self.db.query(UserReference).filter(
-                UserReference.user_id == user_id
-            ).first()
-            if existing_user:
-                    return
-            
-            user = UserReference(
-                user_id=user_id,
-                username=user_data.get('username'),
-                slug=user_data.get('slug'),
-                email=user_data.get('email'),
-                is_active=True,
-                synced_at=datetime.now(timezone.utc)
-            )
-            self.db.add(user)
-            self.db.commit()
+            async with SessionLocal() as db:
+                existing_user = await self._get_user(db, user_id)
+                if existing_user:
+                        return
+                
+                user = UserReference(
+                    user_id=user_id,
+                    username=user_data.get('username'),
+                    slug=user_data.get('slug'),
+                    email=user_data.get('email'),
+                    is_active=True,
+                    synced_at=utcnow()
+                )
+                db.add(user)
+                await db.commit()
         except Exception as e:
              print('create user exception : ', e)
     
     async def _handle_update(self, user_data: dict):
         try:
             user_id = uuid.UUID(user_data['id'])
-            existing_user = self.db.query(UserReference).filter(
-                UserReference.user_id == user_id
-            ).first()
 
-            if not existing_user:
-                    await self._handle_create(user_data)
-                    return
+            async with SessionLocal() as db:
+                existing_user = await self._get_user(db, user_id)
 
-            existing_user.username=user_data.get('username')
-            existing_user.slug=user_data.get('slug')
-            existing_user.email=user_data.get('email')
-            existing_user.synced_at=datetime.now(timezone.utc)
-            
-            self.db.add(existing_user)
-            self.db.commit()
+                if not existing_user:
+                        await self._handle_create(user_data)
+                        return
+
+                existing_user.username=user_data.get('username')
+                existing_user.slug=user_data.get('slug')
+                existing_user.email=user_data.get('email')
+                existing_user.synced_at=utcnow()
+                
+                db.add(existing_user)
+                await db.commit()
         except Exception as e:
              print('update user exception : ', e)
 
@@ -86,15 +118,25 @@ class UserEventManager:
         try:
             user_id = uuid.UUID(user_data['id'])
 
-            existing_user = await self.db.query(UserReference).filter(
-                UserReference.user_id == user_id
-            )
-            if not existing_user:
-                    return
+            async with SessionLocal() as db:
+                existing_user = await self._get_user(db, user_id)
+                if not existing_user:
+                        return
 
-            self.db.delete(existing_user)
-            self.db.commit()
+                await db.delete(existing_user)
+                await db.commit()
+
+                await social_graph.remove_user(db, user_id)
         except Exception as e:
              print('delete user exception : ', e)
+
+    async def _handle_edge(self, _type: str, edge_data: dict):
+        try:
+            handler, from_key, to_key = self.EDGE_EVENTS[_type]
+
+            async with SessionLocal() as db:
+                await handler(db, uuid.UUID(edge_data[from_key]), uuid.UUID(edge_data[to_key]))
+        except Exception as e:
+             print(f'{_type} exception : ', e)
         
 user_events = UserEventManager()
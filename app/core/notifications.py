@@ -1,41 +1,359 @@
-import asyncio
-from typing import Iterable
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import os
 import json
+import time
+import asyncio
+import re
+import uuid
+from collections import OrderedDict, deque
+from fastapi import Request
 from core.cache import redis_client
+from core.pubsub import pubsub_hub
+
+# appends the event to the user's capped inbox stream and publishes it with 
+# its stream id in front ("<id> <event>"), in one step so live and replayed 
+# events carry the same ids
+PUBLISH_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[3], '*', 'event', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('PUBLISH', ARGV[2], id .. ' ' .. ARGV[1])
+return id
+"""
+
+EVENT_ID = re.compile(r'^\d+-\d+$')
+
+
+def valid_event_id(event_id: Optional[str]) -> bool:
+    return bool(event_id) and EVENT_ID.match(event_id) is not None
+
+
+def _id_key(event_id: str) -> Tuple[int, int]:
+    ms, seq = event_id.split('-')
+    return int(ms), int(seq)
+
+
+def format_event(event_id: str, data: str) -> str:
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+
+class FanOutProgress:
+    """How far a notify_users fan-out got, updated after every chunk"""
+
+    def __init__(self, event_type: str, total: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.event_type = event_type
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        # recipients of the failed chunks, for the caller to retry
+        self.failed_user_ids: List[str] = []
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def snapshot(self) -> dict:
+        return {
+            "id": self.id,
+            "event_type": self.event_type,
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "elapsed_ms": round(((self.finished or time.monotonic()) - self.started) * 1000, 1),
+        }
+
 
 class NotificationManager:
-    def __init__(self):
+    def __init__(
+        self, 
+        heartbeat_interval: float = 15, 
+        max_batch: int = 100, 
+        chunk_size: int = 1000, 
+        concurrency: int = 4,
+        inbox_length: int = 1000,
+        inbox_ttl: int = 60*60*24*7,
+    ):
         self.redis = redis_client
+        self.script = self.redis.register_script(PUBLISH_SCRIPT)
+        # every stream of the process reads from the one shared pub/sub connection
+        self.hub = pubsub_hub
+        # idle streams get a comment line this often, keeps proxies from 
+        # closing them and finds clients that went away
+        self.heartbeat_interval = heartbeat_interval
+        self.max_batch = max_batch
+        # fan-outs publish `chunk_size` messages per round trip, with at most 
+        # `concurrency` chunks in flight across all fan-outs of the process
+        self.chunk_size = chunk_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.fan_outs: Dict[str, FanOutProgress] = {}
+        # the latest (about) `inbox_length` events of a user are kept for 
+        # reconnecting clients and /notifications/history
+        self.inbox_length = inbox_length
+        self.inbox_ttl = inbox_ttl
     
-    async def generate_message_stream(self, client_id:str):
-        async with self.redis.pubsub() as pubsub:
-            await pubsub.subscribe(f'notifications:{client_id}')
+    async def generate_message_stream(
+        self, 
+        client_id:str, 
+        request: Optional[Request] = None, 
+        last_event_id: Optional[str] = None,
+    ):
+        """
+        Server-sent events of the client, written as soon as they arrive; 
+        events that queued up meanwhile go out in one write. a reconnecting 
+        client gets the events after `last_event_id` from its inbox first
+        """
+        channel = f'notifications:{client_id}'
+        # subscribed before reading the inbox, nothing falls in between
+        queue = await self.hub.subscribe(channel)
+        try:
+            # sent right away so the client knows the stream is open
+            yield ": connected\n\n"
+
+            replayed = None
+            if valid_event_id(last_event_id):
+                missed = await self.redis.xrange(
+                    f'notifications:inbox:{client_id}', f'({last_event_id}', '+', count=self.inbox_length
+                )
+                if missed:
+                    yield "".join(format_event(event_id, fields['event']) for event_id, fields in missed)
+                    replayed = _id_key(missed[-1][0])
+
             while True:
-                message = await pubsub.get_message(ignore_subscribe_messages=True)
-                if message:
-                    yield f"data: {message['data']}\n\n"
-                await asyncio.sleep(1)
+                try:
+                    data = await asyncio.wait_for(queue.get(), self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    if request is not None and await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+
+                messages = [data]
+                while len(messages) < self.max_batch and not queue.empty():
+                    messages.append(queue.get_nowait())
+
+                events = []
+                for message in messages:
+                    event_id, _, event = message.partition(' ')
+                    if not valid_event_id(event_id):
+                        # published without an inbox (older instances)
+                        events.append(f"data: {message}\n\n")
+                        continue
+                    # already sent from the inbox
+                    if replayed and _id_key(event_id) <= replayed:
+                        continue
+                    events.append(format_event(event_id, event))
+
+                if events:
+                    yield "".join(events)
+        finally:
+            # also runs when the response is cancelled on disconnect
+            self.hub.unsubscribe(channel, queue)
+
+    @staticmethod
+    def channel(user_id: str) -> str:
+        return f'notifications:user_{user_id}'
+
+    @staticmethod
+    def inbox(user_id: str) -> str:
+        return f'notifications:inbox:user_{user_id}'
+
+    @staticmethod
+    def message(event_type: str, data: dict) -> str:
+        return json.dumps({
+            "type": event_type,
+            "data": {k: str(v) for k, v in data.items()}
+        })
+
+    def _publish(self, user_id: str, message: str, client=None):
+        return self.script(
+            keys=[self.inbox(user_id)], 
+            args=[message, self.channel(user_id), self.inbox_length, self.inbox_ttl],
+            client=client,
+        )
 
     async def publish(self, user_id:str, event_type: str, data: dict):
-        client_id = f"user_{user_id}"
-
-        for k, v in data.items():
-            data[k] = str(v)
-        
-        await self.redis.publish(
-            f'notifications:{client_id}',
-            json.dumps({
-                "type": event_type,
-                "data": data
-            })
+        await self._publish(user_id, self.message(event_type, data))
+
+    async def history(self, user_id: str, count: int, before: Optional[str] = None) -> List[dict]:
+        """Events of the user's inbox, newest first, older than `before` when given"""
+        events = await self.redis.xrevrange(
+            self.inbox(user_id), f'({before}' if before else '+', '-', count=count
         )
+        return [{"id": event_id, **json.loads(fields['event'])} for event_id, fields in events]
 
     async def notify_user(self, user_id: str, event_type: str, data: dict):
         await self.publish(user_id, event_type, data)
 
-    async def notify_users(self, user_ids: Iterable[str], event_type: str, data: dict):
-        # Filter by user_id if needed
-        for user_id in user_ids:
-            await self.publish(user_id, event_type, data)
+    async def notify_users(
+        self, 
+        user_ids: Iterable[str], 
+        event_type: str, 
+        data: dict, 
+        on_progress: Optional[Callable[[FanOutProgress], None]] = None,
+    ) -> FanOutProgress:
+        """
+        Publishes the same event to many users, serialized once and sent in 
+        pipelined chunks; a failed chunk is counted (its recipients are in 
+        `failed_user_ids`) and the rest still go out
+        """
+        user_ids = list(user_ids)
+        message = self.message(event_type, data)
+
+        progress = FanOutProgress(event_type, len(user_ids))
+        self.fan_outs[progress.id] = progress
+
+        async def send_chunk(chunk):
+            async with self.semaphore:
+                try:
+                    async with self.redis.pipeline(transaction=False) as pipe:
+                        for user_id in chunk:
+                            await self._publish(user_id, message, client=pipe)
+                        await pipe.execute()
+                    progress.sent += len(chunk)
+                except Exception as e:
+                    print(f'notification fan-out {progress.id} chunk failed: {e}')
+                    progress.failed += len(chunk)
+                    progress.failed_user_ids.extend(chunk)
+
+            if on_progress:
+                on_progress(progress)
+
+        try:
+            await asyncio.gather(*(
+                send_chunk(user_ids[i:i + self.chunk_size]) 
+                for i in range(0, len(user_ids), self.chunk_size)
+            ))
+        finally:
+            progress.finished = time.monotonic()
+            del self.fan_outs[progress.id]
+
+        return progress
+
+    def snapshot(self) -> dict:
+        return {
+            "fan_outs": [progress.snapshot() for progress in self.fan_outs.values()],
+        }
+
+notifications = NotificationManager(
+    heartbeat_interval=float(os.environ.get('NOTIFICATION_HEARTBEAT_INTERVAL', 15)),
+    max_batch=int(os.environ.get('NOTIFICATION_MAX_BATCH', 100)),
+    chunk_size=int(os.environ.get('NOTIFICATION_FANOUT_CHUNK_SIZE', 1000)),
+    concurrency=int(os.environ.get('NOTIFICATION_FANOUT_CONCURRENCY', 4)),
+    inbox_length=int(os.environ.get('NOTIFICATION_INBOX_LENGTH', 1000)),
+    inbox_ttl=int(os.environ.get('NOTIFICATION_INBOX_TTL', 60*60*24*7)),
+)
+
+
+class NotificationAggregator:
+    """
+    Groups events of the same (recipient, post, type): the first one is sent 
+    right away and opens a `window` of seconds, the events that follow in the 
+    window are sent as one when it closes. a single follower goes out as it 
+    came, several add `count` and `latest_actors` (newest first) to the latest 
+    event's data. at most `max_pending` windows are open, the oldest is 
+    closed early when full
+    """
+
+    def __init__(
+        self, 
+        manager: NotificationManager, 
+        window: float = 1.0, 
+        max_pending: int = 10000, 
+        max_actors: int = 3,
+    ):
+        self.manager = manager
+        self.window = window
+        self.max_pending = max_pending
+        self.max_actors = max_actors
+        # (user id, post id, event type) -> group, oldest first
+        self.pending: "OrderedDict[Tuple[str, str, str], dict]" = OrderedDict()
+        self.sending = set()
+        self.received = 0
+        self.sent = 0
+
+    async def add(self, user_id: str, event_type: str, post_id: str, actor_id: str, data: dict):
+        if self.window <= 0:
+            await self.manager.notify_user(user_id, event_type, data)
+            return
+
+        self.received += 1
+        key = (str(user_id), str(post_id), event_type)
+
+        group = self.pending.get(key)
+        if group is None:
+            if len(self.pending) >= self.max_pending:
+                self._flush(next(iter(self.pending)))
+
+            # the window is opened before sending, events arriving meanwhile join it
+            self.pending[key] = {
+                "count": 0,
+                "actors": deque(maxlen=self.max_actors),
+                "data": None,
+                "timer": asyncio.get_running_loop().call_later(self.window, self._flush, key),
+            }
+            try:
+                await self.manager.notify_user(user_id, event_type, data)
+                self.sent += 1
+            except Exception:
+                # not sent, the retry of the event is sent right away too
+                group = self.pending.pop(key, None)
+                if group is not None:
+                    group['timer'].cancel()
+                raise
+            return
+
+        group['count'] += 1
+        group['data'] = data
+        actors, actor_id = group['actors'], str(actor_id)
+        if actor_id in actors:
+            actors.remove(actor_id)
+        actors.appendleft(actor_id)
+
+    def _flush(self, key: Tuple[str, str, str]):
+        group = self.pending.pop(key, None)
+        if group is None:
+            return
+
+        group['timer'].cancel()
+        if not group['count']:
+            return  # nothing followed the first event
+
+        task = asyncio.create_task(self._send(key, group))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def _send(self, key: Tuple[str, str, str], group: dict):
+        user_id, post_id, event_type = key
+
+        data = group['data']
+        if group['count'] > 1:
+            data = {**data, "count": group['count'], "latest_actors": ",".join(group['actors'])}
+
+        try:
+            await self.manager.notify_user(user_id, event_type, data)
+            self.sent += 1
+        except Exception as e:
+            print(f'{event_type} notification of post {post_id} failed: {e}')
+
+    async def shutdown(self):
+        """Sends what is still buffered, called on FastAPI shutdown"""
+        for key in list(self.pending):
+            self._flush(key)
+        if self.sending:
+            await asyncio.gather(*self.sending, return_exceptions=True)
+
+    def snapshot(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "received": self.received,
+            "sent": self.sent,
+        }
+
 
-notifications = NotificationManager()
+notification_aggregator = NotificationAggregator(
+    notifications,
+    window=float(os.environ.get('NOTIFICATION_AGGREGATION_WINDOW', 1)),
+    max_pending=int(os.environ.get('NOTIFICATION_AGGREGATION_MAX_PENDING', 10000)),
+)
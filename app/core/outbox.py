@@ -0,0 +1,161 @@
+import asyncio
+import os
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Optional
+from sqlalchemy import select, delete, update
+from db.database import SessionLocal, AsyncSession
+from models.outbox import OutboxEvent, utcnow
+from core.background_tasks import notify_new_post, notify_followers, notify_post_liked, notify_new_comment
+
+# event type -> handler, called with the payload as keyword arguments
+HANDLERS: Dict[str, Callable[..., Awaitable]] = {
+    'post_created': notify_new_post,
+    # followers a post_created event failed to notify
+    'new_post_notifications': notify_followers,
+    'post_liked': notify_post_liked,
+    'comment_created': notify_new_comment,
+}
+
+
+def enqueue(db: AsyncSession, event_type: str, **payload):
+    """Adds an event to the outbox, committed (or rolled back) with the session's write"""
+    if event_type not in HANDLERS:
+        raise ValueError(f'unknown outbox event {event_type}')
+
+    db.add(OutboxEvent(event_type=event_type, payload=payload))
+
+
+class OutboxRelay:
+    """
+    Drains the outbox in batches and runs the events' handlers. a batch is 
+    claimed in a short transaction (rows locked with SKIP LOCKED, so several 
+    relays can share the outbox) by leasing it for `lease` seconds, the 
+    handlers run outside any transaction and the results are written in a 
+    second one. a handler gets at most `handler_timeout` seconds, a failed 
+    event is retried with a growing delay up to `max_attempts`, an event whose 
+    relay died is retried once its lease is over
+    """
+
+    def __init__(
+        self, 
+        batch_size: int = 100, 
+        poll_interval: float = 0.5, 
+        max_attempts: int = 5, 
+        retry_delay: float = 5,
+        lease: float = 300,
+        handler_timeout: float = 60,
+    ):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        # below the lease, a slow event is settled before another relay claims it
+        self.handler_timeout = min(handler_timeout, lease)
+        self.session_factory = SessionLocal
+        self.task = None
+
+    async def startup(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def shutdown(self):
+        """Called on FastAPI shutdown"""
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        while True:
+            try:
+                drained = await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print('outbox relay exception : ', e)
+                drained = 0
+
+            # a full batch means there is more waiting
+            if drained < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def drain(self) -> int:
+        """Runs one batch of due events, returns how many there were"""
+        events, lease_until = await self.claim()
+        if not events:
+            return 0
+
+        results = await asyncio.gather(*[self.handle(event) for event in events])
+
+        await self.settle(events, results, lease_until)
+        return len(events)
+
+    async def handle(self, event: OutboxEvent) -> Optional[Exception]:
+        """Runs the event's handler, returns its error (None when it succeeded)"""
+        handler = HANDLERS.get(event.event_type)
+        if handler is None:
+            return LookupError(f'unknown outbox event {event.event_type}')
+
+        try:
+            await asyncio.wait_for(handler(**event.payload), self.handler_timeout)
+        except asyncio.TimeoutError:
+            return TimeoutError(f'handler took more than {self.handler_timeout}s')
+        except Exception as e:
+            return e
+        return None
+
+    async def claim(self):
+        """Leases the next batch of due events, an attempt is counted for each"""
+        lease_until = utcnow() + timedelta(seconds=self.lease)
+
+        async with self.session_factory() as db:
+            events = (await db.scalars(
+                select(OutboxEvent)
+                .where(
+                    OutboxEvent.available_at <= utcnow(),
+                    OutboxEvent.attempts < self.max_attempts,
+                )
+                .order_by(OutboxEvent.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+
+            for event in events:
+                event.attempts += 1
+                event.available_at = lease_until
+            await db.commit()
+
+        return events, lease_until
+
+    async def settle(self, events, results, lease_until):
+        """Deletes the events that succeeded and schedules the retry of the others"""
+        async with self.session_factory() as db:
+            done = []
+            for event, result in zip(events, results):
+                if not isinstance(result, Exception):
+                    done.append(event.id)
+                    continue
+
+                print(f'outbox event {event.id} ({event.event_type}) failed: {result!r}')
+                await db.execute(
+                    update(OutboxEvent)
+                    # not when the lease ran out and another relay has the event now
+                    .where(OutboxEvent.id == event.id, OutboxEvent.available_at == lease_until)
+                    .values(
+                        last_error=repr(result),
+                        available_at=utcnow() + timedelta(seconds=self.retry_delay * 2 ** (event.attempts - 1)),
+                    )
+                )
+
+            if done:
+                await db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(done)))
+            await db.commit()
+
+
+outbox_relay = OutboxRelay(
+    batch_size=int(os.environ.get('OUTBOX_BATCH_SIZE', 100)),
+    poll_interval=float(os.environ.get('OUTBOX_POLL_INTERVAL', 0.5)),
+    lease=float(os.environ.get('OUTBOX_LEASE', 300)),
+    handler_timeout=float(os.environ.get('OUTBOX_HANDLER_TIMEOUT', 60)),
+)
+
+# the relay runs inside the API workers unless it is deployed on its own (relay.py)
+OUTBOX_RELAY_EMBEDDED = os.environ.get('OUTBOX_RELAY_EMBEDDED', 'true').lower() in ('1', 'true', 'yes')
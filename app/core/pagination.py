@@ -0,0 +1,66 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Optional, Sequence, Tuple
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+# list endpoints return the cursor of the next page in this header, 
+# the body stays a plain list (offset pagination keeps working)
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(created_at: datetime, pk: uuid.UUID) -> str:
+    raw = json.dumps([created_at.isoformat(), str(pk)])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, pk = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(pk)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def seek(created_at_column, id_column, cursor: str):
+    """
+    Predicate for the rows after the cursor in (created_at DESC, id DESC) order,
+    a row comparison the database can answer from the (…, created_at) indexes
+    """
+    created_at, pk = decode_cursor(cursor)
+    return tuple_(created_at_column, id_column) < tuple_(created_at, pk)
+
+
+def paginate(
+    q, 
+    created_at_column, 
+    id_column, 
+    limit: int, 
+    offset: int = 0, 
+    cursor: Optional[str] = None
+):
+    """
+    Orders the statement newest first and applies the cursor (or the offset 
+    when there is none). one extra row is fetched to know if there's a next page
+    """
+    if cursor:
+        q = q.where(seek(created_at_column, id_column, cursor))
+    elif offset:
+        q = q.offset(offset)
+
+    return (
+        q.order_by(created_at_column.desc(), id_column.desc())
+        .limit(limit + 1)
+    )
+
+
+def set_next_cursor(response: Response, rows: Sequence[Any], limit: int, key=lambda r: (r.created_at, r.id)):
+    """Sets the next page's cursor header and returns the rows of this page"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(rows[-1]))
+
+    return rows
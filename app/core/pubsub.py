@@ -0,0 +1,114 @@
+import os
+import asyncio
+from typing import Dict, Set
+from core.cache import redis_client
+
+class PubSubHub:
+    """
+    One redis pub/sub connection per process shared by every local listener:
+    channels are subscribed while they have listeners (reference counted) and
+    each message is handed to the listeners' own queues
+    """
+
+    def __init__(self, queue_size: int = 1000):
+        self.redis = redis_client
+        self.queue_size = queue_size
+        self.pubsub = None
+        self.task = None
+        self.listeners: Dict[str, Set[asyncio.Queue]] = {}
+        # keeps subscribe/unsubscribe commands in the order they were asked for
+        self.lock = asyncio.Lock()
+        self.dropped = 0
+        self.unsubscribing = set()
+
+    async def subscribe(self, channel: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+
+        queues = self.listeners.setdefault(channel, set())
+        queues.add(queue)
+
+        if len(queues) == 1:
+            try:
+                async with self.lock:
+                    if self.pubsub is None:
+                        self.pubsub = self.redis.pubsub()
+                    await self.pubsub.subscribe(channel)
+            except BaseException:
+                self.unsubscribe(channel, queue)
+                raise
+
+            if self.task is None:
+                self.task = asyncio.create_task(self._read())
+
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue):
+        """
+        Not a coroutine so it can run in the `finally` of a cancelled stream, 
+        the UNSUBSCRIBE itself is sent in the background
+        """
+        queues = self.listeners.get(channel)
+        if not queues or queue not in queues:
+            return
+
+        queues.discard(queue)
+        if not queues:
+            del self.listeners[channel]
+            task = asyncio.create_task(self._unsubscribe(channel))
+            self.unsubscribing.add(task)
+            task.add_done_callback(self.unsubscribing.discard)
+
+    async def _unsubscribe(self, channel: str):
+        async with self.lock:
+            # subscribed again while waiting for the lock
+            if channel not in self.listeners and self.pubsub is not None:
+                await self.pubsub.unsubscribe(channel)
+
+    async def shutdown(self):
+        """Called on FastAPI shutdown"""
+        pubsub, task = self.pubsub, self.task
+        self.pubsub, self.task = None, None
+        self.listeners.clear()
+
+        if task:
+            # the reader also stops by itself once pubsub is unset, 
+            # in case a read swallows the cancellation
+            task.cancel()
+            await asyncio.wait([task], timeout=5)
+        if pubsub:
+            await pubsub.aclose()
+
+    async def _read(self):
+        while self.pubsub is not None:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # the connection is re-established (and resubscribed) on the next read
+                print('pubsub exception : ', e)
+                await asyncio.sleep(1)
+                continue
+
+            if message and message['type'] == 'message':
+                self._dispatch(message['channel'], message['data'])
+
+    def _dispatch(self, channel: str, data):
+        for queue in self.listeners.get(channel, ()):
+            if queue.full():
+                # a listener that doesn't keep up loses its oldest messages
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(data)
+
+    def snapshot(self) -> dict:
+        return {
+            "channels": len(self.listeners),
+            "listeners": sum(len(queues) for queues in self.listeners.values()),
+            "dropped": self.dropped,
+        }
+
+
+pubsub_hub = PubSubHub(
+    queue_size=int(os.environ.get('NOTIFICATION_QUEUE_SIZE', 1000)),
+)
@@ -0,0 +1,69 @@
+import asyncio
+import uuid
+from typing import Awaitable, Callable, List, Tuple
+from core.cache import redis_client
+
+# extends the lock only while it's still held by the given token
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+class PeriodicTaskManager:
+    """
+    Runs registered jobs every `interval` seconds; a redis lock makes sure only 
+    one worker runs a job per interval. the lock is renewed while the job 
+    runs, a job slower than its interval is never run twice at the same time
+    """
+    def __init__(self):
+        self.redis = redis_client
+        self.renew_lock = self.redis.register_script(RENEW_SCRIPT)
+        self.jobs: List[Tuple[Callable[[], Awaitable], float]] = []
+        self.tasks: List[asyncio.Task] = []
+
+    def register(self, job: Callable[[], Awaitable], interval: float):
+        self.jobs.append((job, interval))
+
+    async def startup(self):
+        for job, interval in self.jobs:
+            self.tasks.append(asyncio.create_task(self._run(job, interval)))
+
+    async def shutdown(self):
+        """Called on FastAPI shutdown"""
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def _run(self, job: Callable[[], Awaitable], interval: float):
+        key = f'scheduler:{job.__qualname__}'
+        ttl = int(interval * 1000)
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                token = uuid.uuid4().hex
+                acquired = await self.redis.set(key, token, nx=True, px=ttl)
+                if acquired:
+                    renewing = asyncio.create_task(self._renew(key, token, ttl))
+                    try:
+                        await job()
+                    finally:
+                        # not released, it expires an interval after the last 
+                        # renewal so the job still runs once per interval
+                        renewing.cancel()
+            except Exception as e:
+                print(f'{job.__qualname__} exception : ', e)
+
+    async def _renew(self, key: str, token: str, ttl: int):
+        while True:
+            await asyncio.sleep(ttl / 1000 / 3)
+            try:
+                if not await self.renew_lock(keys=[key], args=[token, ttl]):
+                    print(f'{key} lock was lost while the job was running')
+                    return
+            except Exception as e:
+                print(f'{key} lock renewal exception : ', e)
+
+scheduler = PeriodicTaskManager()
@@ -0,0 +1,28 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the 
+    call, the others wait for its result (or its exception) instead of 
+    repeating it. nothing is kept once the call is done
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self.calls.get(key)
+        if future is not None:
+            # shielded, a cancelled waiter must not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(fn())
+        self.calls[key] = future
+        future.add_done_callback(lambda _: self.calls.pop(key, None))
+
+        return await asyncio.shield(future)
+
+
+# Global instance
+single_flight = SingleFlight()
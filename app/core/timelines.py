@@ -0,0 +1,45 @@
+import os
+import uuid
+from typing import Iterable, List
+from core.cache import redis_client
+
+class TimelineManager:
+    """
+    Materialized home timelines (fan-out on write): a redis sorted set per user
+    of the post ids of the users they follow, scored by creation time and
+    trimmed to the newest `max_length` posts
+    """
+
+    def __init__(self, max_length: int = 800, ttl: int = 60*60*24*14, chunk_size: int = 1000):
+        self.redis = redis_client
+        self.max_length = max_length
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def key(user_id) -> str:
+        return f'timeline:{user_id}'
+
+    async def fan_out(self, post_id: str, score: float, user_ids: Iterable[str]):
+        """Adds a new post to the timelines of the given users"""
+        user_ids = list(user_ids)
+
+        # one round trip per chunk of followers
+        for i in range(0, len(user_ids), self.chunk_size):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids[i:i + self.chunk_size]:
+                    key = self.key(user_id)
+                    pipe.zadd(key, {str(post_id): score})
+                    pipe.zremrangebyrank(key, 0, -self.max_length - 1)
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+
+    async def page(self, user_id: str, limit: int, offset: int = 0) -> List[uuid.UUID]:
+        """Post ids of the user's timeline, newest first"""
+        post_ids = await self.redis.zrevrange(self.key(user_id), offset, offset + limit - 1)
+        return [uuid.UUID(pk) for pk in post_ids]
+
+
+timelines = TimelineManager(
+    max_length=int(os.environ.get('TIMELINE_MAX_LENGTH', 800)),
+)
@@ -0,0 +1,310 @@
+from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
+import os, random, asyncio, time
+from abc import ABC, abstractmethod
+from core.codecs import MessageCodec, CONTENT_TYPE_HEADER, CONTENT_ENCODING_HEADER
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+Headers = Sequence[Tuple[str, bytes]]
+
+
+class Message(NamedTuple):
+    topic: str
+    key: Optional[bytes]
+    value: bytes
+    headers: Headers
+
+
+class ProducerMetrics:
+    """Queue depth, acknowledged batch sizes and send latency of a producer"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.in_flight = 0
+        self.failed = 0
+        self.acked = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.batches = 0
+        self.batch_max = 0
+        self._batch = 0
+
+    def enqueued(self, size: int):
+        self.messages += 1
+        self.bytes += size
+        self.in_flight += 1
+
+    def delivered(self, delivery: asyncio.Future, latency: float):
+        self.in_flight -= 1
+        if delivery.cancelled() or delivery.exception() is not None:
+            self.failed += 1
+            return
+
+        self.acked += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+        # a broker response acknowledges its whole batch at once, acks of 
+        # the same loop iteration are counted as one batch
+        if self._batch == 0:
+            asyncio.get_running_loop().call_soon(self._close_batch)
+        self._batch += 1
+
+    def _close_batch(self):
+        self.batches += 1
+        self.batch_max = max(self.batch_max, self._batch)
+        self._batch = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "in_flight": self.in_flight,
+            "failed": self.failed,
+            "batch_avg": round(self.acked / self.batches, 2) if self.batches else 0,
+            "batch_max": self.batch_max,
+            "send_latency_avg_ms": round(self.latency_total / self.acked * 1000, 3) if self.acked else 0,
+            "send_latency_max_ms": round(self.latency_max * 1000, 3),
+        }
+
+
+class Transport(ABC):
+    """
+    What the request/response managers need from a message broker: sending
+    raw messages, and iterating over the messages of subscribed topics
+    """
+
+    metrics: ProducerMetrics
+
+    @abstractmethod
+    async def start_producer(self):
+        ...
+
+    @abstractmethod
+    async def enqueue(self, topic: str, key: str, value: bytes, headers: Headers = ()) -> asyncio.Future:
+        """Queues a message, the returned future is done once it is delivered (or failed)"""
+
+    async def send(self, topic: str, key: str, value: bytes, headers: Headers = ()):
+        """Sends a message and waits for its delivery"""
+        await (await self.enqueue(topic, key, value, headers))
+
+    @abstractmethod
+    async def subscribe(self, topics: List[str]):
+        ...
+
+    @abstractmethod
+    def __aiter__(self) -> AsyncIterator[Message]:
+        ...
+
+    @abstractmethod
+    async def stop(self):
+        ...
+
+
+class KafkaTransport(Transport):
+    def __init__(
+        self, 
+        bootstrap_servers: Optional[str] = None, 
+        compression_type: Optional[str] = 'gzip',
+        linger_ms: int = 0,
+        max_batch_size: int = 16384,
+    ):
+        self.bootstrap_servers = bootstrap_servers or os.environ.get('KAFKA_URL', None)
+        self.compression_type = compression_type
+        self.linger_ms = linger_ms
+        self.max_batch_size = max_batch_size
+        self.metrics = ProducerMetrics()
+        self.producer = None
+        self.consumer = None
+
+    async def start_producer(self):
+        self.producer = AIOKafkaProducer(
+            bootstrap_servers=self.bootstrap_servers,
+            compression_type=self.compression_type,
+            linger_ms=self.linger_ms,
+            max_batch_size=self.max_batch_size,
+        )
+        await self.producer.start()
+
+    async def enqueue(self, topic: str, key: str, value: bytes, headers: Headers = ()) -> asyncio.Future:
+        start = time.perf_counter()
+        self.metrics.enqueued(len(value))
+
+        try:
+            delivery = await self.producer.send(
+                topic,
+                key=key.encode('utf-8'),
+                value=value,
+                headers=list(headers),
+            )
+        except Exception:
+            self.metrics.in_flight -= 1
+            self.metrics.failed += 1
+            raise
+
+        delivery.add_done_callback(lambda f: self.metrics.delivered(f, time.perf_counter() - start))
+        return delivery
+
+    async def subscribe(self, topics: List[str]):
+        self.consumer = AIOKafkaConsumer(bootstrap_servers=self.bootstrap_servers or '')
+        self.consumer.subscribe(topics)
+        await self.consumer.start()
+
+    async def __aiter__(self):
+        async for msg in self.consumer:
+            yield Message(msg.topic, msg.key, msg.value, msg.headers)
+
+    async def stop(self):
+        if self.producer:
+            await self.producer.stop()
+        if self.consumer:
+            await self.consumer.stop()
+
+
+class InMemoryBroker:
+    """Topics of one process; every subscribed transport gets every message of its topics"""
+
+    def __init__(self):
+        self.subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self.published = 0
+
+    def publish(self, message: Message):
+        self.published += 1
+        for queue in self.subscribers.get(message.topic, []):
+            queue.put_nowait(message)
+
+    def subscribe(self, topics: List[str], queue: asyncio.Queue):
+        for topic in topics:
+            self.subscribers.setdefault(topic, []).append(queue)
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        for queues in self.subscribers.values():
+            if queue in queues:
+                queues.remove(queue)
+
+
+class InMemoryTransport(Transport):
+    """Transport over an InMemoryBroker, for tests and offline benchmarks"""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.metrics = ProducerMetrics()
+
+    async def start_producer(self):
+        pass
+
+    async def enqueue(self, topic: str, key: str, value: bytes, headers: Headers = ()) -> asyncio.Future:
+        self.metrics.enqueued(len(value))
+        self.broker.publish(Message(topic, key.encode('utf-8'), value, tuple(headers)))
+
+        delivery = asyncio.get_running_loop().create_future()
+        delivery.add_done_callback(lambda f: self.metrics.delivered(f, 0))
+        delivery.set_result(None)
+        return delivery
+
+    async def subscribe(self, topics: List[str]):
+        self.broker.subscribe(topics, self.queue)
+
+    async def __aiter__(self):
+        while True:
+            yield await self.queue.get()
+
+    async def stop(self):
+        self.broker.unsubscribe(self.queue)
+
+
+class ScriptedResponder:
+    """
+    Stand-in for the user service on an InMemoryBroker: answers followers and
+    blocked-users requests (single and batch) from in-memory data, with
+    scripted latency, dropped requests and generated follower lists
+    """
+
+    REQUEST_TOPICS = ['request-followers', 'request-blocked-users']
+
+    def __init__(
+        self,
+        broker: InMemoryBroker,
+        followers: Optional[Dict[str, List[str]]] = None,
+        blocked_users: Optional[Dict[str, List[str]]] = None,
+        blocked_by_users: Optional[Dict[str, List[str]]] = None,
+        follower_count: int = 0,
+        latency: Callable[[], float] = lambda: 0,
+        drop_rate: float = 0,
+        seed: Optional[int] = None,
+    ):
+        self.transport = InMemoryTransport(broker)
+        self.followers = followers or {}
+        self.blocked_users = blocked_users or {}
+        self.blocked_by_users = blocked_by_users or {}
+        # users without an entry get this many generated followers
+        self.follower_count = follower_count
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.received: List[Tuple[str, dict]] = []
+        self.dropped = 0
+        self.task = None
+        self.replies = set()
+
+    async def startup(self):
+        await self.transport.subscribe(self.REQUEST_TOPICS)
+        self.task = asyncio.create_task(self._serve())
+
+    async def shutdown(self):
+        if self.task:
+            self.task.cancel()
+        for task in self.replies:
+            task.cancel()
+        await self.transport.stop()
+
+    def answer(self, topic: str, user_id: str) -> dict:
+        if topic == 'request-followers':
+            followers = self.followers.get(user_id)
+            if followers is None:
+                followers = [f'{user_id}-follower-{i}' for i in range(self.follower_count)]
+            return {"status": "200", "followers": followers}
+
+        return {
+            "status": "200",
+            "blocked_users": self.blocked_users.get(user_id, []),
+            "blocked_by_users": self.blocked_by_users.get(user_id, []),
+        }
+
+    async def _serve(self):
+        async for msg in self.transport:
+            request = MessageCodec.decode(msg.value, msg.headers)
+            self.received.append((msg.topic, request))
+
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                self.dropped += 1
+                continue
+
+            # replies are delayed independently, like a service handling requests concurrently
+            task = asyncio.create_task(self._reply(msg, request))
+            self.replies.add(task)
+            task.add_done_callback(self.replies.discard)
+
+    async def _reply(self, msg: Message, request: dict):
+        delay = self.latency()
+        if delay:
+            await asyncio.sleep(delay)
+
+        if 'user_ids' in request:
+            reply = {
+                "request_id": request['request_id'],
+                "results": {pk: self.answer(msg.topic, pk) for pk in request['user_ids']},
+            }
+        else:
+            reply = {"request_id": request['request_id'], **self.answer(msg.topic, request['user_id'])}
+
+        # answered in the format of the request, the other headers (reply-to) are copied
+        value, content_headers = MessageCodec(*MessageCodec.content_type(msg.headers)).encode(reply)
+        headers = [
+            (name, v) for name, v in msg.headers 
+            if name not in (CONTENT_TYPE_HEADER, CONTENT_ENCODING_HEADER)
+        ]
+
+        topic = request.get('reply_topic') or msg.topic.replace('request-', 'response-', 1)
+        await self.transport.send(topic, request['request_id'], value, headers + content_headers)
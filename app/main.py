@@ -1,12 +1,19 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from routers import post, interactions, stats, notifications
+from routers import post, interactions, stats, notifications, metrics
 from db import database
 from contextlib import asynccontextmanager
 from core.communications import request_manager, response_manager
 from core.cache import redis_client
+from core.pubsub import pubsub_hub
+from core.notifications import notification_aggregator
 from core.events import user_events
+from core.scheduler import scheduler
+from core.outbox import outbox_relay, OUTBOX_RELAY_EMBEDDED
+from core.background_tasks import reconcile_post_counters
+from core.counters import view_counter, unique_viewers
+from core.pagination import NEXT_CURSOR_HEADER
 
 
 @asynccontextmanager
@@ -21,21 +28,38 @@ async def lifespan(app: FastAPI):
 
     await redis_client.ping()
     await user_events.startup()
+    await scheduler.startup()
     print('redis is ready')
 
+    if OUTBOX_RELAY_EMBEDDED:
+        await outbox_relay.startup()
+
     yield  # The app runs here
+
+    await outbox_relay.shutdown()
+    await notification_aggregator.shutdown()
         
     await response_manager.shutdown()
     await request_manager.shutdown()
     print('kafka shutdown')
 
+    await pubsub_hub.shutdown()
     await user_events.shutdown()
+    await scheduler.shutdown()
     await redis_client.aclose()
     print('redis shutdown')
 
+    await database.engine.dispose()
+    await database.replicas.dispose()
+
     print("Shutdown complete!")
 
 
+scheduler.register(reconcile_post_counters, interval=60*60)
+scheduler.register(view_counter.flush, interval=5)
+if unique_viewers.enabled:
+    scheduler.register(unique_viewers.rollup, interval=60)
+
 app = FastAPI(lifespan=lifespan)
 
 origins = ['127.0.0.1', 'localhost']
@@ -43,11 +67,11 @@ app.add_middleware(CORSMiddleware,
                    allow_origins=origins,
                    allow_methods=['*'],
                    allow_headers=['*'],
+                   expose_headers=[NEXT_CURSOR_HEADER],
                    )
 
-database.Base.metadata.create_all(bind=database.engine)
-
 app.include_router(post.router, prefix='/api')
 app.include_router(interactions.router, prefix='/api')
 app.include_router(stats.router, prefix='/api')
 app.include_router(notifications.router, prefix='')
+app.include_router(metrics.router, prefix='')
@@ -0,0 +1,92 @@
+"""initial schema
+
+the tables as main.py used to create them with Base.metadata.create_all,
+databases created that way are marked with: alembic stamp 0001
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 15:39:06.013937
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _base_columns():
+    return [
+        sa.Column('id', sa.UUID(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('soft_delete', sa.Boolean(), nullable=True),
+    ]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_references',
+        sa.Column('user_id', sa.UUID(), nullable=False),
+        sa.Column('username', sa.String(length=32), nullable=True),
+        sa.Column('slug', sa.String(length=32), nullable=True),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('synced_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id'),
+        sa.UniqueConstraint('user_id')
+    )
+
+    op.create_table('posts',
+        sa.Column('user_id', sa.UUID(), nullable=False),
+        sa.Column('file_path', sa.String(length=255), nullable=True),
+        sa.Column('caption', sa.Text(), nullable=True),
+        sa.Column('views', sa.Integer(), nullable=True),
+        *_base_columns(),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_posts_id', 'posts', ['id'])
+    op.create_index('ix_posts_user_id', 'posts', ['user_id'])
+
+    op.create_table('tags',
+        sa.Column('name', sa.String(length=50), nullable=True),
+        *_base_columns(),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_index('ix_tags_id', 'tags', ['id'])
+
+    op.create_table('post_tags',
+        sa.Column('post_id', sa.UUID(), nullable=False),
+        sa.Column('tag_id', sa.UUID(), nullable=False),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ),
+        sa.PrimaryKeyConstraint('post_id', 'tag_id')
+    )
+
+    for table, unique in (('likes', 'unique_like'), ('comments', None), ('bookmarks', 'unique_bookmark')):
+        op.create_table(table,
+            sa.Column('user_id', sa.UUID(), nullable=False),
+            sa.Column('post_id', sa.UUID(), nullable=False),
+            *([sa.Column('content', sa.Text(), nullable=True)] if table == 'comments' else []),
+            *_base_columns(),
+            sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['user_id'], ['user_references.user_id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            *([sa.UniqueConstraint('user_id', 'post_id', name=unique)] if unique else []),
+        )
+        op.create_index(f'ix_{table}_id', table, ['id'])
+        op.create_index(f'ix_{table}_post_id', table, ['post_id'])
+        op.create_index(f'ix_{table}_user_id', table, ['user_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('bookmarks', 'comments', 'likes', 'post_tags', 'tags', 'posts', 'user_references'):
+        op.drop_table(table)
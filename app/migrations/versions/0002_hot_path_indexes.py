@@ -0,0 +1,58 @@
+"""hot path indexes
+
+composite indexes matching the list queries (filter columns first, then the 
+created_at they are ordered by), so pages are read from the index instead 
+of scanning and sorting the whole table.
+
+built CONCURRENTLY on postgresql so writes are not blocked on big tables, 
+that can't run inside a transaction hence the autocommit block.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 15:52:41.201774
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    # list_posts
+    ('ix_posts_soft_delete_created_at', 'posts', ['soft_delete', sa.text('created_at DESC')], {}),
+    # list_posts?user=, user_stats
+    ('ix_posts_user_id_soft_delete_created_at', 'posts', ['user_id', 'soft_delete', 'created_at'], {}),
+    # list_comments_by_post
+    ('ix_comments_post_id_soft_delete_created_at', 'comments', ['post_id', 'soft_delete', 'created_at'], {}),
+    # list_comments_by_user (partial, deleted comments are never listed)
+    ('ix_comments_user_id_created_at_live', 'comments', ['user_id', 'created_at'], {
+        'postgresql_where': sa.text('soft_delete = false'),
+        'sqlite_where': sa.text('soft_delete = 0'),
+    }),
+    # list_likes_by_user
+    ('ix_likes_user_id_created_at', 'likes', ['user_id', 'created_at'], {}),
+    # list_bookmarks_by_user
+    ('ix_bookmarks_user_id_created_at', 'bookmarks', ['user_id', 'created_at'], {}),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns, kw in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, **kw)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
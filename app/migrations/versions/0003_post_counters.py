@@ -0,0 +1,48 @@
+"""post counters
+
+denormalized likes/comments/bookmarks counters on posts, backfilled from the
+interaction tables
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 16:24:10.538120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+COUNTERS = ('likes_count', 'comments_count', 'bookmarks_count')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('posts') as batch_op:
+        for column in COUNTERS:
+            batch_op.add_column(sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+
+    op.execute("""
+        UPDATE posts SET
+            likes_count = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id),
+            comments_count = (
+                SELECT count(*) FROM comments 
+                WHERE comments.post_id = posts.id AND comments.soft_delete = false
+            ),
+            bookmarks_count = (SELECT count(*) FROM bookmarks WHERE bookmarks.post_id = posts.id)
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('posts') as batch_op:
+        for column in COUNTERS:
+            batch_op.drop_column(column)
@@ -0,0 +1,45 @@
+"""social graph
+
+follows/blocks edge tables, replicated from the user service's change events
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 18:11:52.407316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('follows',
+        sa.Column('followee_id', sa.UUID(), nullable=False),
+        sa.Column('follower_id', sa.UUID(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('followee_id', 'follower_id')
+    )
+    op.create_index('ix_follows_follower_id', 'follows', ['follower_id'])
+
+    op.create_table('blocks',
+        sa.Column('blocker_id', sa.UUID(), nullable=False),
+        sa.Column('blocked_id', sa.UUID(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('blocker_id', 'blocked_id')
+    )
+    op.create_index('ix_blocks_blocked_id', 'blocks', ['blocked_id', 'blocker_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('blocks')
+    op.drop_table('follows')
@@ -3,10 +3,16 @@ import uuid
 from datetime import datetime, timezone
 from db import database
 
+
+def utcnow() -> datetime:
+    # naive utc, the columns are timestamps without time zone
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class BaseModel(database.Base):
     __abstract__ = True  
 
     id = Column(UUID, primary_key=True, default=uuid.uuid4, index=True)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
-    updated_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=True)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, nullable=True)
     soft_delete = Column(Boolean, default=False)
\ No newline at end of file
@@ -0,0 +1,35 @@
+# graph.py
+from sqlalchemy import Column, DateTime, Index
+from sqlalchemy.dialects.postgresql import UUID
+from models.base import utcnow
+from db import database
+
+# local copy of the user service's follow/block relations, kept in sync from 
+# its change events (core/events.py). no foreign keys, an edge may arrive 
+# before its users do
+
+class Follow(database.Base):
+    __tablename__ = 'follows'
+    __table_args__ = (
+        # follows of a user
+        Index('ix_follows_follower_id', 'follower_id'),
+        {'extend_existing': True}
+    )
+
+    # primary key order serves "followers of a user" (notify_new_post)
+    followee_id = Column(UUID(as_uuid=True), primary_key=True)
+    follower_id = Column(UUID(as_uuid=True), primary_key=True)
+    created_at = Column(DateTime, default=utcnow)
+
+
+class Block(database.Base):
+    __tablename__ = 'blocks'
+    __table_args__ = (
+        # users that blocked a user
+        Index('ix_blocks_blocked_id', 'blocked_id', 'blocker_id'),
+        {'extend_existing': True}
+    )
+
+    blocker_id = Column(UUID(as_uuid=True), primary_key=True)
+    blocked_id = Column(UUID(as_uuid=True), primary_key=True)
+    created_at = Column(DateTime, default=utcnow)
@@ -1,5 +1,5 @@
 # interaction.py
-from sqlalchemy import Column, Text, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Text, ForeignKey, UniqueConstraint, Index, text
 from sqlalchemy.dialects.postgresql import UUID
 from models.base import BaseModel
 
@@ -7,6 +7,8 @@ class Like(BaseModel):
     __tablename__ = 'likes'
     __table_args__ = (
         UniqueConstraint('user_id', 'post_id', name='unique_like'),
+        # list_likes_by_user
+        Index('ix_likes_user_id_created_at', 'user_id', 'created_at'),
         {'extend_existing': True}
     )
 
@@ -19,6 +21,14 @@ class Comment(BaseModel):
     __table_args__ = (
         # uncomment in case you want only one comment per post
         # UniqueConstraint('user_id', 'post_id', name='unique_comment'), 
+        # list_comments_by_post
+        Index('ix_comments_post_id_soft_delete_created_at', 'post_id', 'soft_delete', 'created_at'),
+        # list_comments_by_user, only live comments are ever listed
+        Index(
+            'ix_comments_user_id_created_at_live', 'user_id', 'created_at',
+            postgresql_where=text('soft_delete = false'),
+            sqlite_where=text('soft_delete = 0'),
+        ),
         {'extend_existing': True}
     )
 
@@ -31,6 +41,8 @@ class Bookmark(BaseModel):
     __tablename__ = 'bookmarks'
     __table_args__ = (
         UniqueConstraint('user_id', 'post_id', name='unique_bookmark'),
+        # list_bookmarks_by_user
+        Index('ix_bookmarks_user_id_created_at', 'user_id', 'created_at'),
         {'extend_existing': True}
     )
 
@@ -0,0 +1,26 @@
+# outbox.py
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Index
+from db import database
+from models.base import utcnow
+
+
+class OutboxEvent(database.Base):
+    """
+    Side effects of a write (notifications, fan-out), inserted in the same 
+    transaction as the write and run by the outbox relay (core/outbox.py)
+    """
+    __tablename__ = 'outbox_events'
+    __table_args__ = (
+        # next batch of the relay
+        Index('ix_outbox_events_available_at_id', 'available_at', 'id'),
+        {'extend_existing': True}
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_type = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=utcnow)
+    # retried with a backoff until max attempts, then kept for inspection
+    available_at = Column(DateTime, default=utcnow, nullable=False)
+    attempts = Column(Integer, default=0, server_default='0', nullable=False)
+    last_error = Column(Text)
@@ -1,8 +1,7 @@
-from sqlalchemy import Column, Text, String, ForeignKey, Integer, Boolean, DateTime, Table
+from sqlalchemy import Column, Text, String, ForeignKey, Integer, Boolean, DateTime, Table, Index, desc
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
-from models.base import BaseModel
-from datetime import datetime, timezone
+from models.base import BaseModel, utcnow
 from db import database
 
 BaseModel.metadata.clear()
@@ -23,17 +22,31 @@ class UserReference(database.Base):
     slug = Column(String(32))
     email = Column(String)
     is_active = Column(Boolean, default=True)
-    synced_at = Column(DateTime, default=datetime.now(timezone.utc))
+    synced_at = Column(DateTime, default=utcnow)
 
     
 class Post(BaseModel):
     __tablename__ = 'posts'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # list_posts: newest live posts
+        Index('ix_posts_soft_delete_created_at', 'soft_delete', desc('created_at')),
+        # list_posts?user= and user stats
+        Index('ix_posts_user_id_soft_delete_created_at', 'user_id', 'soft_delete', 'created_at'),
+        {'extend_existing': True}
+    )
     
     user_id = Column(UUID(as_uuid=True), index=True, nullable=False)
     file_path = Column(String(255))
     caption = Column(Text)
     views = Column(Integer, default=0)
+    # deduplicated viewers, rolled up from redis (core/counters.py)
+    unique_views = Column(Integer, default=0, server_default='0', nullable=False)
+
+    # denormalized counters, kept in the transaction that adds/removes the 
+    # interaction (routers/interactions.py), see reconcile_post_counters
+    likes_count = Column(Integer, default=0, server_default='0', nullable=False)
+    comments_count = Column(Integer, default=0, server_default='0', nullable=False)
+    bookmarks_count = Column(Integer, default=0, server_default='0', nullable=False)
     
     user = relationship(
         "UserReference",
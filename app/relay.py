@@ -0,0 +1,34 @@
+"""
+Outbox relay as its own process, so follower fan-out and notifications don't 
+run on the API workers (set OUTBOX_RELAY_EMBEDDED=false for those)
+
+    cd app
+    python relay.py
+"""
+import asyncio
+from core.communications import request_manager, response_manager
+from core.cache import redis_client
+from core.outbox import outbox_relay
+from core.notifications import notification_aggregator
+
+
+async def main():
+    await response_manager.startup()
+    await request_manager.startup()
+    await redis_client.ping()
+    print('outbox relay is running')
+
+    try:
+        await outbox_relay.run()
+    finally:
+        await notification_aggregator.shutdown()
+        await response_manager.shutdown()
+        await request_manager.shutdown()
+        await redis_client.aclose()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,15 +1,18 @@
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Form, status, Path, Query
-from db.database import db, Session
+from fastapi import APIRouter, Depends, HTTPException, Form, status, Path, Query, Response
+from db.database import db, read_db, AsyncSession
 from schemas import interaction as schema, post as post_schema
 from models import (
     post as models, 
     interaction as iModels
 )
 from core.oauth import get_current_user
-from core.background_tasks import notify_post_liked, notify_new_comment
-from sqlalchemy import func
+from core import outbox
+from core.pagination import paginate, set_next_cursor, NEXT_CURSOR_HEADER
+from core.counters import view_counter
+from core.cache import invalidate_user_stats
+from sqlalchemy import select, update
 import uuid
-from typing import List
+from typing import List, Optional
 
 router = APIRouter(
     prefix='/interactions',
@@ -17,34 +20,51 @@ router = APIRouter(
     dependencies=[]
 )
 
+
+async def update_post_counter(db: AsyncSession, post_id: uuid.UUID, column: str, delta: int):
+    """Adds delta to one of the post's denormalized counters, committed with the interaction"""
+    counter = getattr(models.Post, column)
+
+    await db.execute(
+        update(models.Post)
+        .where(models.Post.id == post_id)
+        .values({column: counter + delta})
+    )
+
+
 @router.post('/likes')
 async def toggle_like(
-    background_tasks: BackgroundTasks,
     post_id:str = Form(...),
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(db)
 ):
     try:
         valid_post_id = uuid.UUID(post_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid post id")
 
-    post = db.query(models.Post).filter(
-        models.Post.id == valid_post_id, 
-        models.Post.soft_delete == False
-    ).first()
+    post = (await db.scalars(
+        select(models.Post).where(
+            models.Post.id == valid_post_id, 
+            models.Post.soft_delete == False
+        )
+    )).first()
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    already_liked = db.query(iModels.Like).filter(
-        iModels.Like.post_id == post.id,
-        iModels.Like.user_id == uuid.UUID(user_id)
-    ).first()
+    already_liked = (await db.scalars(
+        select(iModels.Like).where(
+            iModels.Like.post_id == post.id,
+            iModels.Like.user_id == uuid.UUID(user_id)
+        )
+    )).first()
 
     if already_liked:
-        db.delete(already_liked)
-        db.commit()
+        await db.delete(already_liked)
+        await update_post_counter(db, post.id, 'likes_count', -1)
+        await db.commit()
+        await invalidate_user_stats(user_id)
         return { 'value': 0 } # like removed
 
     like = iModels.Like(
@@ -52,79 +72,68 @@ async def toggle_like(
         user_id = uuid.UUID(user_id)
     )
     db.add(like)
-    db.commit()
+    await update_post_counter(db, post.id, 'likes_count', 1)
 
     # like notification
-    background_tasks.add_task(
-        notify_post_liked,
-        post_id,        # post id
-        user_id,        # liker id
-        post.user_id,   # author id
+    outbox.enqueue(
+        db, 'post_liked',
+        post_id=post_id,
+        liker_id=user_id,
+        author_id=str(post.user_id),
     )
+    await db.commit()
+    await invalidate_user_stats(user_id)
 
     return { 'value': 1 } # liked
 
 
 @router.get('/likes', response_model=List[post_schema.PostResponse])
 async def list_likes_by_user(
+    response: Response,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description=f"Cursor of the next page, from the {NEXT_CURSOR_HEADER} header"),
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(read_db)
 ):
-    posts = (
-        db.query(models.Post)
+    # newest like first, served by the likes (user_id, created_at) index
+    rows = (await db.execute(paginate(
+        select(models.Post, iModels.Like.created_at, iModels.Like.id)
         .join(
             iModels.Like, iModels.Like.post_id == models.Post.id, 
         )
-        .filter(
+        .where(
             models.Post.soft_delete == False,
             iModels.Like.user_id == uuid.UUID(user_id)
-        )
-        .order_by(models.Post.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
+        ),
+        iModels.Like.created_at, iModels.Like.id,
+        limit, offset, cursor
+    ))).all()
+    posts = [row[0] for row in set_next_cursor(response, rows, limit, key=lambda row: (row[1], row[2]))]
 
-    like_counts = dict(
-        db.query(iModels.Like.post_id, func.count())
-        .filter(iModels.Like.post_id.in_([p.id for p in posts]))
-        .group_by(iModels.Like.post_id)
-        .all()
-    )
-
-    comment_counts = dict(
-        db.query(iModels.Comment.post_id, func.count())
-        .filter(iModels.Comment.post_id.in_([p.id for p in posts]))
-        .group_by(iModels.Comment.post_id)
-        .all()
-    )
-
-    for post in posts:
-        post.likes_count = like_counts.get(post.id, 0)
-        post.comments_count = comment_counts.get(post.id, 0)
+    await view_counter.merge(posts)
 
     return posts
 
 
 @router.post('/comments', response_model=schema.CommentResponse)
 async def comment_on_post(
-    background_tasks: BackgroundTasks,
     post_id:str = Form(...),
     comment:str = Form(...),
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(db)
 ):
     try:
         valid_post_id = uuid.UUID(post_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid post id")
     
-    post = db.query(models.Post).filter(
-        models.Post.id == valid_post_id, 
-        models.Post.soft_delete == False
-    ).first()
+    post = (await db.scalars(
+        select(models.Post).where(
+            models.Post.id == valid_post_id, 
+            models.Post.soft_delete == False
+        )
+    )).first()
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
@@ -138,98 +147,98 @@ async def comment_on_post(
         content = comment
     )
     db.add(post_comment)
-    db.commit()
-    
-    background_tasks.add_task(
-        notify_new_comment,
-        post_id,        # post id
-        user_id,        # liker id
-        post.user_id,   # author id
-        comment
+    await update_post_counter(db, post.id, 'comments_count', 1)
+
+    outbox.enqueue(
+        db, 'comment_created',
+        post_id=post_id,
+        commenter_id=user_id,
+        author_id=str(post.user_id),
+        comment=comment,
     )
+    await db.commit()
+    await invalidate_user_stats(user_id)
 
     return post_comment
 
 @router.get('/comments', response_model=List[schema.CommentResponse])
 async def list_comments_by_user(
+    response: Response,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description=f"Cursor of the next page, from the {NEXT_CURSOR_HEADER} header"),
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(read_db)
 ):
   
-    comments = (
-        db.query(iModels.Comment)
-        .filter(
+    comments = (await db.scalars(paginate(
+        select(iModels.Comment)
+        .where(
             iModels.Comment.user_id == uuid.UUID(user_id),
             iModels.Comment.soft_delete == False
-        )
-        .order_by(iModels.Comment.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
-    return comments
+        ),
+        iModels.Comment.created_at, iModels.Comment.id,
+        limit, offset, cursor
+    ))).all()
+    return set_next_cursor(response, comments, limit)
 
 
 @router.get('/comments/{post_id}', response_model=List[schema.CommentResponse])
 async def list_comments_by_post(
+    response: Response,
     post_id:str = Path(...),
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description=f"Cursor of the next page, from the {NEXT_CURSOR_HEADER} header"),
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(read_db)
 ):
     try:
         valid_post_id = uuid.UUID(post_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid post id")
     
-    post = (
-        db.query(models.Post)
-        .filter(
+    post = (await db.scalars(
+        select(models.Post)
+        .where(
             models.Post.id == valid_post_id,
             models.Post.soft_delete == False,
         )
-        .first()
-    )
+    )).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    comments = (
-        db.query(iModels.Comment)
-         .filter(
+    comments = (await db.scalars(paginate(
+        select(iModels.Comment)
+         .where(
             iModels.Comment.post_id == uuid.UUID(post_id),
             iModels.Comment.soft_delete == False,
-         )
-         .order_by(iModels.Comment.created_at.desc())
-         .offset(offset)
-         .limit(limit)
-         .all()
-    )
+         ),
+        iModels.Comment.created_at, iModels.Comment.id,
+        limit, offset, cursor
+    ))).all()
 
-    return comments
+    return set_next_cursor(response, comments, limit)
 
 
 @router.delete('/comments/{comment_id}', status_code=status.HTTP_204_NO_CONTENT)
 async def delete_comment(
     comment_id:str = Path(...),
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(db)
 ):
     try:
         valid_comment_id = uuid.UUID(comment_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid comment id")
     
-    comment = (
-        db.query(iModels.Comment)
-        .filter(
+    comment = (await db.scalars(
+        select(iModels.Comment)
+        .where(
             iModels.Comment.id == valid_comment_id,
             iModels.Comment.soft_delete == False,
         )
-        .first()
-    )
+    )).first()
 
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
@@ -239,7 +248,9 @@ async def delete_comment(
     
     comment.soft_delete = True
     db.add(comment)
-    db.commit()
+    await update_post_counter(db, comment.post_id, 'comments_count', -1)
+    await db.commit()
+    await invalidate_user_stats(user_id)
 
     return
 
@@ -248,29 +259,35 @@ async def delete_comment(
 async def toggle_bookmark(
     post_id:str = Form(...),
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(db)
 ):
     try:
         valid_post_id = uuid.UUID(post_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid post id")
     
-    post = db.query(models.Post).filter(
-        models.Post.id == valid_post_id, 
-        models.Post.soft_delete == False
-    ).first()
+    post = (await db.scalars(
+        select(models.Post).where(
+            models.Post.id == valid_post_id, 
+            models.Post.soft_delete == False
+        )
+    )).first()
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    already_marked = db.query(iModels.Bookmark).filter(
-        iModels.Bookmark.post_id == post.id,
-        iModels.Bookmark.user_id == uuid.UUID(user_id)
-    ).first()
+    already_marked = (await db.scalars(
+        select(iModels.Bookmark).where(
+            iModels.Bookmark.post_id == post.id,
+            iModels.Bookmark.user_id == uuid.UUID(user_id)
+        )
+    )).first()
 
     if already_marked:
-        db.delete(already_marked)
-        db.commit()
+        await db.delete(already_marked)
+        await update_post_counter(db, post.id, 'bookmarks_count', -1)
+        await db.commit()
+        await invalidate_user_stats(user_id)
         return { 'value': 0 } # bookmark removed
     
     bookmark = iModels.Bookmark(
@@ -278,48 +295,36 @@ async def toggle_bookmark(
         user_id = uuid.UUID(user_id)
     )
     db.add(bookmark)
-    db.commit()
+    await update_post_counter(db, post.id, 'bookmarks_count', 1)
+    await db.commit()
+    await invalidate_user_stats(user_id)
     return { 'value': 1 } # bookmarked
 
 
 @router.get('/bookmarks', response_model=List[post_schema.PostResponse])
 async def list_bookmarks_by_user(
+    response: Response,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description=f"Cursor of the next page, from the {NEXT_CURSOR_HEADER} header"),
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(read_db)
 ):
-    posts = (
-        db.query(models.Post)
+    # newest bookmark first, served by the bookmarks (user_id, created_at) index
+    rows = (await db.execute(paginate(
+        select(models.Post, iModels.Bookmark.created_at, iModels.Bookmark.id)
         .join(
             iModels.Bookmark, iModels.Bookmark.post_id == models.Post.id, 
         )
-        .filter(
+        .where(
             models.Post.soft_delete == False,
             iModels.Bookmark.user_id == uuid.UUID(user_id)
-        )
-        .order_by(models.Post.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
-
-    like_counts = dict(
-        db.query(iModels.Like.post_id, func.count())
-        .filter(iModels.Like.post_id.in_([p.id for p in posts]))
-        .group_by(iModels.Like.post_id)
-        .all()
-    )
-
-    comment_counts = dict(
-        db.query(iModels.Comment.post_id, func.count())
-        .filter(iModels.Comment.post_id.in_([p.id for p in posts]))
-        .group_by(iModels.Comment.post_id)
-        .all()
-    )
+        ),
+        iModels.Bookmark.created_at, iModels.Bookmark.id,
+        limit, offset, cursor
+    ))).all()
+    posts = [row[0] for row in set_next_cursor(response, rows, limit, key=lambda row: (row[1], row[2]))]
 
-    for post in posts:
-        post.likes_count = like_counts.get(post.id, 0)
-        post.comments_count = comment_counts.get(post.id, 0)
+    await view_counter.merge(posts)
 
     return posts
\ No newline at end of file
@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from db.database import pool_metrics
+from core.communications import request_manager
+from core.pubsub import pubsub_hub
+from core.notifications import notifications, notification_aggregator
+
+router = APIRouter(
+    prefix='/metrics',
+    tags=['metrics'],
+    dependencies=[]
+)
+
+
+@router.get('/')
+async def service_metrics():
+    return {
+        "db_pool": {name: m.snapshot() for name, m in pool_metrics.items()},
+        "kafka_producer": request_manager.transport.metrics.snapshot() if request_manager.transport else None,
+        "pubsub": pubsub_hub.snapshot(),
+        "notifications": notifications.snapshot(),
+        "notification_aggregation": notification_aggregator.snapshot(),
+    }
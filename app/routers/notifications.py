@@ -1,14 +1,42 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response, Header, Query, HTTPException
 from fastapi.responses import StreamingResponse
-from core.notifications import notifications
+from core.notifications import notifications, valid_event_id
 from core.oauth import get_current_user
+from core.pagination import NEXT_CURSOR_HEADER
+from schemas.notification import NotificationResponse
+from typing import List, Optional
 
 router = APIRouter()
 
 @router.get("/notifications/")
 async def stream_notifications(
-    user_id: str = Depends(get_current_user)
+    request: Request,
+    user_id: str = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(None, description="Sent by EventSource on reconnect, missed events are replayed"),
 ):
     client_id = f"user_{user_id}"
     
-    return StreamingResponse(notifications.generate_message_stream(client_id), media_type="text/event-stream")
+    return StreamingResponse(
+        notifications.generate_message_stream(client_id, request, last_event_id), 
+        media_type="text/event-stream",
+        # events are written as they come, nothing on the way should buffer them
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/notifications/history", response_model=List[NotificationResponse])
+async def notification_history(
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description=f"Cursor of the next page, from the {NEXT_CURSOR_HEADER} header"),
+    user_id: str = Depends(get_current_user),
+):
+    if cursor and not valid_event_id(cursor):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # one extra event to know if there's a next page
+    events = await notifications.history(user_id, limit + 1, cursor)
+    if len(events) > limit:
+        events = events[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = events[-1]['id']
+
+    return events
@@ -7,25 +7,33 @@ from fastapi import (
     Query, 
     Path,
     status, 
-    BackgroundTasks
+    BackgroundTasks,
+    Response,
+    Request
     )
 from fastapi.responses import FileResponse
-from db.database import db, Session
+from db.database import db, read_db, read_from_primary, AsyncSession
 from schemas import post as schema
+from schemas.filters import FeedFilters
 from models import post as models, interaction as iModels
-from core.background_tasks import increment_views, notify_new_post
+from models.base import utcnow
+from core.background_tasks import increment_views
+from core import outbox
+from core.counters import view_counter, unique_viewers
+from core.timelines import timelines
 from core.oauth import get_current_user, get_optional_user
 from dependencies import validate_upload_file
-from sqlalchemy import func
+from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 import shutil
 import os
 import uuid
 from typing import Optional, List
 import json
-from datetime import datetime
-from core.cache import get_redis
-from core.communications import request_manager, response_manager
+from datetime import timezone
+from core.cache import invalidate_user_stats
+from services import user_service, social_graph
+from core.pagination import paginate, set_next_cursor, NEXT_CURSOR_HEADER
 
 router = APIRouter(
     prefix='/posts',
@@ -51,19 +59,32 @@ def get_file_path(file: UploadFile, user_id:str):
     return file_path
 
 
+async def mark_bookmarked(db: AsyncSession, posts: List[models.Post], user_id: str):
+    """Sets is_bookmarked of the posts for the user, in one query"""
+    bookmarked = set((await db.scalars(
+        select(iModels.Bookmark.post_id)
+        .where(
+            iModels.Bookmark.post_id.in_([post.id for post in posts]),
+            iModels.Bookmark.user_id == uuid.UUID(user_id)
+        )
+    )).all())
+
+    for post in posts:
+        post.is_bookmarked = post.id in bookmarked
+
+
 @router.get('/tags', response_model=List[schema.TagBase])
-async def list_tags(db: Session= Depends(db)):
-    tags = db.query(models.Tag).all()
+async def list_tags(db: AsyncSession= Depends(read_db)):
+    tags = (await db.scalars(select(models.Tag))).all()
 
     return tags
 
-@router.post('/')
+@router.post('/', response_model = schema.PostResponse)
 async def create_posts(
-    background_tasks: BackgroundTasks,
     caption:str = Form(...),
     tags:str = Form("[]"),
     file: UploadFile = Depends(validate_upload_file), 
-    db: Session = Depends(db),
+    db: AsyncSession = Depends(db),
     user_id: str = Depends(get_current_user)
 ):
     
@@ -78,42 +99,50 @@ async def create_posts(
         file.file.close()
 
     try:
-        db_post = models.Post(
-            user_id=uuid.UUID(user_id),
-            file_path=file_path,
-            caption=caption.strip(),
-        )
-        db.add(db_post)
-        db.flush()  # Get post ID without committing
-
         # Handle tags
+        # collected before the post is flushed, appending to the collection of a 
+        # persistent post would trigger a lazy load (not allowed on AsyncSession)
+        post_tags = []
         tags = json.loads(tags)
         if tags:
             for tag_name in tags:
                 if not tag_name.strip():
                     continue
 
-                tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
+                tag = (await db.scalars(
+                    select(models.Tag).where(models.Tag.name == tag_name)
+                )).first()
                 if not tag:
                     tag = models.Tag(name=tag_name)
                     db.add(tag)
-                    db.flush()  # Get tag ID without committing
+                    await db.flush()  # Get tag ID without committing
                 
-                db_post.tags.append(tag)
-        
-        db.add(db_post)
-        db.commit()
-        db.refresh(db_post)
+                post_tags.append(tag)
 
-        background_tasks.add_task(
-            notify_new_post,
-            db_post.id,        # post id
-            user_id,        # author id
+        db_post = models.Post(
+            user_id=uuid.UUID(user_id),
+            file_path=file_path,
+            caption=caption.strip(),
+            tags=post_tags,
+        )
+        db.add(db_post)
+        await db.flush()  # id and created_at for the event
+
+        # fan-out and notifications, committed with the post
+        outbox.enqueue(
+            db, 'post_created',
+            post_id=str(db_post.id),
+            author_id=user_id,
+            created_at=db_post.created_at.replace(tzinfo=timezone.utc).timestamp(),  # timeline score
         )
-        return {**db_post.__dict__}
+        await db.commit()
+        await db.refresh(db_post)
+        await invalidate_user_stats(user_id)
+
+        return db_post
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         # Clean up file if DB fails
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -121,50 +150,41 @@ async def create_posts(
 
 @router.get('/', response_model = List[schema.PostResponse])
 async def list_posts(
+    response: Response,
     tags: Optional[str] = Query(None, description="Tag names, e.g. ?tags=python,fastapi"),
     user: Optional[str] = Query(None),
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description=f"Cursor of the next page, from the {NEXT_CURSOR_HEADER} header"),
     current_user_id: Optional[str] = Depends(get_optional_user),
-    db: Session = Depends(db),
-    redis = Depends(get_redis),
+    db: AsyncSession = Depends(read_db),
 ):
-    q = db.query(models.Post).filter(
+    q = select(models.Post.id).where(
         models.Post.soft_delete == False,
     )
     
     if current_user_id:
-        q = q.filter(
+        q = q.where(
             models.Post.user_id != uuid.UUID(current_user_id)
         )
 
-        blocked_user_ids = []
-
-        # check cache for blocked-users
-        key = f'blocked_users:{current_user_id}'
-        cached = await redis.get(key)
-        
-        if cached:
-            blocked_user_ids = json.loads(cached)
+        # users that blocked current user and users current user blocked, 
+        # posts of both are hidden
+        if social_graph.LOCAL:
+            q = q.where(social_graph.not_blocked(current_user_id))
         else:
-            # get list of blocked users from user service
-            correlation_id = await request_manager.request_data(current_user_id, 'request-blocked-users')
-            if correlation_id:
-                response = await response_manager.wait_for_response(correlation_id, timeout=30)
-                if response and response.get('status') == '200':
-
-                    # don't show any post from both users that blocked current user and 
-                    # user that current user blocked them
-                    blocked_user_ids = response['blocked_users'] + response['blocked_by_users']
+            blocked_user_ids = await user_service.get_blocked_users(current_user_id)
 
-                    await redis.setex(key, 60*15, json.dumps(blocked_user_ids))
+            if blocked_user_ids is None:
+                # unknown, the blocks consumed from the user service's events 
+                # hide what they can instead of nothing
+                q = q.where(social_graph.not_blocked(current_user_id))
+            elif blocked_user_ids:
+                blocked_user_ids = [uuid.UUID(pk) for pk in blocked_user_ids]
 
-        if blocked_user_ids:
-            blocked_user_ids = [uuid.UUID(pk) for pk in blocked_user_ids]
-
-            q = q.filter(
-                models.Post.user_id.not_in(blocked_user_ids)
-            )
+                q = q.where(
+                    models.Post.user_id.not_in(blocked_user_ids)
+                )
 
     if user:
         try:
@@ -172,7 +192,7 @@ async def list_posts(
         except:
             raise HTTPException(400, detail='Invalid user id')
         
-        q = q.filter(models.Post.user_id == user_id)
+        q = q.where(models.Post.user_id == user_id)
     
     if tags:
         tag_names = [t.strip() for t in tags.split(',') if t.strip()]
@@ -180,85 +200,101 @@ async def list_posts(
         q = (
             q.join(models.post_tags, models.Post.id == models.post_tags.c.post_id)
              .join(models.Tag, models.Tag.id == models.post_tags.c.tag_id)
-             .filter(models.Tag.name.in_(tag_names))
+             .where(models.Tag.name.in_(tag_names))
              .distinct()
         )
 
-    post_stmt = (
-        q.order_by(models.Post.created_at.desc())
-        .offset(offset)
-        .limit(limit)
+    # created_at is selected too, DISTINCT requires ORDER BY columns in the select list
+    post_stmt = paginate(
+        q.add_columns(models.Post.created_at),
+        models.Post.created_at, models.Post.id,
+        limit, offset, cursor
     )
-    post_ids = [p.id for p in post_stmt.all()]
+    rows = set_next_cursor(response, (await db.execute(post_stmt)).all(), limit)
+    post_ids = [row.id for row in rows]
     
     if not post_ids:
         return []
 
-    posts = (
-        db.query(models.Post)
+    posts = (await db.scalars(
+        select(models.Post)
         .options(selectinload(models.Post.tags))
-        .filter(models.Post.id.in_(post_ids))
-        .order_by(models.Post.created_at.desc())
-        .all()
-    )
-    
-    # Get counts in bulk
-    like_counts = dict(
-        db.query(iModels.Like.post_id, func.count())
-        .filter(iModels.Like.post_id.in_([p.id for p in posts]))
-        .group_by(iModels.Like.post_id)
-        .all()
-    )
-
-    comment_counts = dict(
-        db.query(iModels.Comment.post_id, func.count())
-        .filter(iModels.Comment.post_id.in_([p.id for p in posts]))
-        .group_by(iModels.Comment.post_id)
-        .all()
-    )
+        .where(models.Post.id.in_(post_ids))
+        .order_by(models.Post.created_at.desc(), models.Post.id.desc())
+    )).all()
     
+    # likes/comments counts are columns of the post, only the current user's 
+    # bookmarks are looked up
     if current_user_id:
-        bookmark_counts = dict(
-            db.query(iModels.Bookmark.post_id, func.count())
-            .filter(
-                iModels.Bookmark.post_id.in_([p.id for p in posts]),
-                iModels.Bookmark.user_id == uuid.UUID(current_user_id)
-            )
-            .group_by(iModels.Bookmark.post_id)
-            .all()
+        await mark_bookmarked(db, posts, current_user_id)
+
+    await view_counter.merge(posts)
+
+    return posts
+
+@router.get('/feed', response_model = List[schema.PostResponse])
+async def get_feed(
+    filters: FeedFilters = Depends(),
+    user_id: str = Depends(get_current_user),
+    db: AsyncSession = Depends(read_db),
+):
+    # post ids come from the user's materialized timeline (filled by notify_new_post)
+    post_ids = await timelines.page(user_id, filters.limit, filters.offset)
+    if not post_ids:
+        return []
+
+    posts = (await db.scalars(
+        select(models.Post)
+        .options(selectinload(models.Post.tags))
+        .where(
+            models.Post.id.in_(post_ids),
+            models.Post.soft_delete == False,
         )
+    )).all()
 
-    # Attach counts to posts
-    for post in posts:
-        post.likes_count = like_counts.get(post.id, 0)
-        post.comments_count = comment_counts.get(post.id, 0)
-        if current_user_id:
-            post.is_bookmarked = bool(bookmark_counts.get(post.id, 0))
+    # keep the timeline order, deleted posts are skipped
+    by_id = {post.id: post for post in posts}
+    posts = [by_id[pk] for pk in post_ids if pk in by_id]
+
+    await mark_bookmarked(db, posts, user_id)
+    await view_counter.merge(posts)
 
     return posts
 
 @router.get('/{post_id}', response_model = schema.PostResponse)
 async def get_post_by_id(
     post_id: str, 
+    request: Request,
     background_tasks: BackgroundTasks,
-    db: Session= Depends(db)
+    current_user_id: Optional[str] = Depends(get_optional_user),
+    db: AsyncSession= Depends(read_db)
 ):
     try:
         valid_post_id = uuid.UUID(post_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid post id")
     
-    post = db.query(models.Post).filter(
+    post_stmt = select(models.Post).where(
         models.Post.id == valid_post_id,
         models.Post.soft_delete == False,
-    ).order_by(
-        models.Post.created_at.desc()
-    ).first()
+    )
+    post = (await db.scalars(post_stmt)).first()
+
+    # a post created a moment ago may not be on the replica yet
+    if not post and read_from_primary(db):
+        post = (await db.scalars(post_stmt)).first()
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    background_tasks.add_task(increment_views, post_id)
+    await view_counter.merge([post])
+
+    viewer = unique_viewers.viewer_id(
+        current_user_id, 
+        request.client.host if request.client else None, 
+        request.headers.get('user-agent'),
+    )
+    background_tasks.add_task(increment_views, post_id, str(post.user_id), viewer)
     return post
 
 @router.patch('/{post_id}', response_model = schema.PostResponse)
@@ -266,17 +302,19 @@ async def update_post(
     post_id: str,
     data: schema.PostUpdate,
     user_id: str = Depends(get_current_user),
-    db: Session= Depends(db)
+    db: AsyncSession= Depends(db)
 ):
     try:
         valid_post_id = uuid.UUID(post_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid post id")
     
-    post = db.query(models.Post).filter(
-        models.Post.id == valid_post_id,
-        models.Post.soft_delete == False
-    ).first()
+    post = (await db.scalars(
+        select(models.Post).where(
+            models.Post.id == valid_post_id,
+            models.Post.soft_delete == False
+        )
+    )).first()
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
@@ -295,11 +333,10 @@ async def update_post(
         new_tag_names = list({name.strip() for name in new_tag_names if name.strip()})
 
         # Fetch existing Tag objects
-        existing_tags = (
-            db.query(models.Tag)
-            .filter(models.Tag.name.in_(new_tag_names))
-            .all()
-        )
+        existing_tags = (await db.scalars(
+            select(models.Tag)
+            .where(models.Tag.name.in_(new_tag_names))
+        )).all()
         existing_by_name = {t.name: t for t in existing_tags}
 
         # Create tags that don't exist yet
@@ -309,35 +346,37 @@ async def update_post(
             if not tag:
                 tag = models.Tag(name=name)
                 db.add(tag)
-                db.flush()  # assign id
+                await db.flush()  # assign id
                 existing_by_name[name] = tag
             tags_for_post.append(tag)
 
         # Replace post.tags collection (SQLAlchemy manages PostTag rows)
         post.tags = tags_for_post
 
-    post.updated_at = datetime.now()
+    post.updated_at = utcnow()
     
     db.add(post)
-    db.commit()
-    db.refresh(post)
+    await db.commit()
+    await db.refresh(post)
     return post
 
 @router.delete('/{post_id}', status_code=status.HTTP_204_NO_CONTENT)
 async def delete_post(
     post_id: str = Path(...),
     user_id: str = Depends(get_current_user),
-    db: Session= Depends(db)
+    db: AsyncSession= Depends(db)
 ):
     try:
         valid_post_id = uuid.UUID(post_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid post id")
 
-    post = db.query(models.Post).filter(
-        models.Post.id == valid_post_id,
-        models.Post.soft_delete == False
-    ).first()
+    post = (await db.scalars(
+        select(models.Post).where(
+            models.Post.id == valid_post_id,
+            models.Post.soft_delete == False
+        )
+    )).first()
 
     
     if not post:
@@ -348,7 +387,8 @@ async def delete_post(
     
     post.soft_delete = True
     db.add(post)
-    db.commit()
+    await db.commit()
+    await invalidate_user_stats(user_id)
     
     return
 
@@ -356,17 +396,19 @@ async def delete_post(
 async def serve_post_media(
     post_id: str, 
     user_id: str = Depends(get_current_user),
-    db: Session = Depends(db)
+    db: AsyncSession = Depends(read_db)
 ):
     try:
         valid_post_id = uuid.UUID(post_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid post id")
     
-    post = db.query(models.Post).filter(
-        models.Post.id == valid_post_id,
-        models.Post.soft_delete == False
-    ).first()
+    post = (await db.scalars(
+        select(models.Post).where(
+            models.Post.id == valid_post_id,
+            models.Post.soft_delete == False
+        )
+    )).first()
     
     if not post:
         raise HTTPException(404, "Post not found")
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends
-from db.database import db, Session
+from db.database import db, AsyncSession
 from schemas import post as schema
 from models import post as models, interaction as iModels
 from core.oauth import get_current_user
-from sqlalchemy import desc, func
+from core.counters import unique_viewers
+from core.cache import get_redis, stats_key, STATS_TTL
+from sqlalchemy import func, select
 import uuid
+import json
 
 router = APIRouter(
     prefix='/stats',
@@ -16,40 +19,61 @@ router = APIRouter(
 @router.get('/')
 async def user_stats(
     user_id:str = Depends(get_current_user),
-    db: Session = Depends(db)
+    # counted on the primary, a lagging replica would cache pre-write counts for the ttl
+    db: AsyncSession = Depends(db),
+    redis = Depends(get_redis),
 ):
+    key = stats_key(user_id)
+    cached = await redis.get(key)
+    if cached:
+        return json.loads(cached)
+
     user_uuid = uuid.UUID(user_id)
 
-    # 5 simple, separate queries (cleanest)
-    posts_count = db.query(func.count(models.Post.id)).filter(
-        models.Post.user_id == user_uuid,
-        models.Post.soft_delete == False
-    ).scalar()
-    
-    total_views = db.query(func.coalesce(func.sum(models.Post.views), 0)).filter(
-        models.Post.user_id == user_uuid,
-        models.Post.soft_delete == False
-    ).scalar()
-    
-    likes = db.query(func.count(iModels.Like.id)).filter(
-        iModels.Like.user_id == user_uuid,
-        iModels.Like.soft_delete == False
-    ).scalar()
-    
-    comments = db.query(func.count(iModels.Comment.id)).filter(
-        iModels.Comment.user_id == user_uuid,
-        iModels.Comment.soft_delete == False
-    ).scalar()
-    
-    bookmarks = db.query(func.count(iModels.Bookmark.id)).filter(
-        iModels.Bookmark.user_id == user_uuid,
-        iModels.Bookmark.soft_delete == False
-    ).scalar()
-
-    return {
-        "posts": posts_count or 0,
-        "views": total_views or 0,
-        "likes": likes or 0,
-        "comments": comments or 0,
-        "bookmarks": bookmarks or 0,
-    }
\ No newline at end of file
+    def count(column, *where):
+        return select(func.count(column)).where(*where).scalar_subquery()
+
+    # one round trip, every counter is a scalar subquery served by a user_id index
+    row = (await db.execute(select(
+        count(
+            models.Post.id,
+            models.Post.user_id == user_uuid,
+            models.Post.soft_delete == False,
+        ).label('posts'),
+        select(func.coalesce(func.sum(models.Post.views), 0)).where(
+            models.Post.user_id == user_uuid,
+            models.Post.soft_delete == False,
+        ).scalar_subquery().label('views'),
+        count(
+            iModels.Like.id,
+            iModels.Like.user_id == user_uuid,
+            iModels.Like.soft_delete == False,
+        ).label('likes'),
+        count(
+            iModels.Comment.id,
+            iModels.Comment.user_id == user_uuid,
+            iModels.Comment.soft_delete == False,
+        ).label('comments'),
+        count(
+            iModels.Bookmark.id,
+            iModels.Bookmark.user_id == user_uuid,
+            iModels.Bookmark.soft_delete == False,
+        ).label('bookmarks'),
+    ))).one()
+
+    unique_views = await unique_viewers.author_count(user_id)
+
+    stats = {
+        "posts": row.posts or 0,
+        "views": row.views or 0,
+        "unique_views": unique_views or 0,
+        "likes": row.likes or 0,
+        "comments": row.comments or 0,
+        "bookmarks": row.bookmarks or 0,
+    }
+
+    # dropped by the write paths (invalidate_user_stats), views/unique views 
+    # are flushed in the background so they may lag up to the ttl
+    await redis.setex(key, STATS_TTL, json.dumps(stats))
+
+    return stats
@@ -1,5 +1,5 @@
 # schemas/filters.py
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 import uuid
 
@@ -13,8 +13,8 @@ class PostFilters(BaseModel):
 
 class FeedFilters(BaseModel):
     """For user's feed (followed users)"""
-    limit: int = 20
-    offset: int = 0
+    limit: int = Field(20, ge=1, le=100)
+    offset: int = Field(0, ge=0)
 
 class CommentFilters(BaseModel):
     post_id: uuid.UUID
@@ -0,0 +1,9 @@
+# schemas/notification.py
+from pydantic import BaseModel
+from typing import Dict
+
+class NotificationResponse(BaseModel):
+    """An event of the user's notification inbox, `id` is its SSE event id"""
+    id: str
+    type: str
+    data: Dict[str, str]
@@ -28,6 +28,7 @@ class PostInDB(BaseSchema):
     user_id: uuid.UUID
     caption: Optional[str]
     views: int = 0
+    unique_views: int = 0
 
 class PostResponse(PostInDB):
     """Full response with relationships"""
@@ -35,6 +36,7 @@ class PostResponse(PostInDB):
     tags: List[TagBase] = []
     likes_count: int = 0
     comments_count: int = 0
+    bookmarks_count: int = 0
     is_liked: bool = False
     is_bookmarked: bool = False
     updated_at: datetime
@@ -0,0 +1,150 @@
+from typing import List, Optional
+import asyncio
+import os
+import uuid
+from sqlalchemy import delete, exists, insert, select, union, or_
+from db.database import SessionLocal
+from models import post as models
+from models.graph import Follow, Block
+from core.cache import redis_client
+from core.communications import user_rpc
+
+# where follower/block lookups come from: 'rpc' asks the user service, 'local' 
+# reads the follows/blocks tables (only once they were backfilled)
+SOCIAL_GRAPH_SOURCE = os.environ.get('SOCIAL_GRAPH_SOURCE', 'rpc')
+LOCAL = SOCIAL_GRAPH_SOURCE == 'local'
+
+
+def not_blocked(user_id: str):
+    """
+    Criteria of posts whose author didn't block the user and wasn't blocked by 
+    them, an anti-join on blocks instead of a NOT IN of the ids
+    """
+    user_uuid = uuid.UUID(user_id)
+    return ~exists().where(
+        or_(
+            (Block.blocker_id == user_uuid) & (Block.blocked_id == models.Post.user_id),
+            (Block.blocker_id == models.Post.user_id) & (Block.blocked_id == user_uuid),
+        )
+    )
+
+
+async def get_followers(user_id: str) -> List[str]:
+    async with SessionLocal(info={'read_only': True}) as db:
+        follower_ids = (await db.scalars(
+            select(Follow.follower_id).where(Follow.followee_id == uuid.UUID(str(user_id)))
+        )).all()
+
+    return [str(pk) for pk in follower_ids]
+
+
+# change events of the user service (core/events.py), applied idempotently
+
+async def follow(db, follower_id: uuid.UUID, followee_id: uuid.UUID):
+    await db.merge(Follow(follower_id=follower_id, followee_id=followee_id))
+    await db.commit()
+    await redis_client.delete(f'followers:{followee_id}')
+
+
+async def unfollow(db, follower_id: uuid.UUID, followee_id: uuid.UUID):
+    await db.execute(delete(Follow).where(
+        Follow.follower_id == follower_id, 
+        Follow.followee_id == followee_id,
+    ))
+    await db.commit()
+    await redis_client.delete(f'followers:{followee_id}')
+
+
+async def block(db, blocker_id: uuid.UUID, blocked_id: uuid.UUID):
+    await db.merge(Block(blocker_id=blocker_id, blocked_id=blocked_id))
+    await db.commit()
+    await redis_client.delete(f'blocked_users:{blocker_id}', f'blocked_users:{blocked_id}')
+
+
+async def unblock(db, blocker_id: uuid.UUID, blocked_id: uuid.UUID):
+    await db.execute(delete(Block).where(
+        Block.blocker_id == blocker_id, 
+        Block.blocked_id == blocked_id,
+    ))
+    await db.commit()
+    await redis_client.delete(f'blocked_users:{blocker_id}', f'blocked_users:{blocked_id}')
+
+
+async def remove_user(db, user_id: uuid.UUID):
+    """Drops every edge of a deleted user"""
+    await db.execute(delete(Follow).where(or_(Follow.follower_id == user_id, Follow.followee_id == user_id)))
+    await db.execute(delete(Block).where(or_(Block.blocker_id == user_id, Block.blocked_id == user_id)))
+    await db.commit()
+
+
+# backfill: edges from before the events were consumed (or lost while the 
+# listener was disconnected) come from the user service
+
+async def replace_user_edges(
+    db, 
+    user_id: uuid.UUID, 
+    follower_ids: List[str], 
+    blocked_ids: List[str], 
+    blocked_by_ids: List[str],
+):
+    """
+    Sets the user's followers and every block the user is part of to what the 
+    user service answered, all that post listing and fan-out need of an author
+    """
+    await db.execute(delete(Follow).where(Follow.followee_id == user_id))
+    await db.execute(delete(Block).where(or_(Block.blocker_id == user_id, Block.blocked_id == user_id)))
+
+    follows = [{"follower_id": uuid.UUID(pk), "followee_id": user_id} for pk in set(follower_ids)]
+    blocks = [
+        *({"blocker_id": user_id, "blocked_id": uuid.UUID(pk)} for pk in set(blocked_ids)),
+        *({"blocker_id": uuid.UUID(pk), "blocked_id": user_id} for pk in set(blocked_by_ids) - set(blocked_ids)),
+    ]
+    if follows:
+        await db.execute(insert(Follow), follows)
+    if blocks:
+        await db.execute(insert(Block), blocks)
+
+    await db.commit()
+    await redis_client.delete(f'followers:{user_id}', f'blocked_users:{user_id}')
+
+
+async def _fetch_edges(user_id: uuid.UUID, timeout: float) -> Optional[tuple]:
+    followers, blocked = await asyncio.gather(
+        user_rpc.call('request-followers', str(user_id), timeout=timeout),
+        user_rpc.call('request-blocked-users', str(user_id), timeout=timeout),
+    )
+    if not followers or not blocked or blocked.get('status') != '200':
+        return None
+
+    return followers['followers'], blocked['blocked_users'], blocked['blocked_by_users']
+
+
+async def backfill(batch_size: int = 100, timeout: float = 30) -> dict:
+    """
+    Rebuilds the edges of every known user (authors and synced user references) 
+    from the user service, a batch of users at a time. users the service 
+    doesn't answer for keep their edges and are counted as failed
+    """
+    async with SessionLocal() as db:
+        user_ids = (await db.scalars(
+            union(select(models.Post.user_id), select(models.UserReference.user_id))
+        )).all()
+
+    synced = failed = 0
+    for i in range(0, len(user_ids), batch_size):
+        batch = user_ids[i:i + batch_size]
+        edges = await asyncio.gather(*[_fetch_edges(user_id, timeout) for user_id in batch])
+
+        async with SessionLocal() as db:
+            for user_id, user_edges in zip(batch, edges):
+                if user_edges is None:
+                    print(f'backfill: no answer for {user_id}, edges kept')
+                    failed += 1
+                    continue
+
+                await replace_user_edges(db, user_id, *user_edges)
+                synced += 1
+
+        print(f'backfill: {synced + failed}/{len(user_ids)} users')
+
+    return {"users": len(user_ids), "synced": synced, "failed": failed}
@@ -0,0 +1,184 @@
+from typing import List, Optional
+import asyncio
+import json
+import os
+import time
+from core.cache import redis_client
+from core.communications import user_rpc
+from core.singleflight import single_flight
+from core.breaker import CircuitBreaker
+from services import social_graph
+
+FOLLOWERS_TTL = 60*5
+
+
+async def _lookup(topic: str, user_id: str, key: str, ttl: int, parse) -> Optional[List[str]]:
+    """
+    Cache first, then one kafka round trip (and one cache write) shared by 
+    every concurrent caller asking for the same (topic, user)
+    """
+    cached = await redis_client.get(key)
+    if cached:
+        return json.loads(cached)
+
+    async def fetch():
+        try:
+            reply = await user_rpc.call(topic, user_id, timeout=30)
+        except Exception as e:
+            print(f'{topic} for {user_id} failed: {e!r}')
+            return None
+
+        result = parse(reply)
+        if result is not None:
+            await redis_client.setex(key, ttl, json.dumps(result))
+
+        return result
+
+    return await single_flight.do((topic, str(user_id)), fetch)
+
+
+def _parse_blocked_users(reply: Optional[dict]) -> Optional[List[str]]:
+    if reply and reply.get('status') == '200':
+        # both users the user blocked and users that blocked the user
+        return reply['blocked_users'] + reply['blocked_by_users']
+    return None
+
+
+def _parse_followers(reply: Optional[dict]) -> Optional[List[str]]:
+    if reply:
+        return reply['followers']
+    return None
+
+
+class BlocklistProvider:
+    """
+    Stale-while-revalidate blocklists: a cached list is served right away, 
+    once older than `soft_ttl` it is refreshed and served stale when the 
+    refresh takes more than `budget` seconds, it is dropped after `hard_ttl`. 
+    with nothing cached the caller waits for the user service (at most 
+    `timeout`), a circuit breaker skips the user service while it fails
+    """
+
+    def __init__(
+        self, 
+        soft_ttl: float = 60*15, 
+        hard_ttl: int = 60*60*24, 
+        budget: float = 0.15, 
+        timeout: float = 5,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.redis = redis_client
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.budget = budget
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker('user-service-blocklist')
+        self.refreshing = set()
+
+    @staticmethod
+    def key(user_id) -> str:
+        return f'blocked_users:{user_id}'
+
+    async def get(self, user_id: str) -> Optional[List[str]]:
+        """Ids of users blocked by or blocking the user, None when unknown"""
+        cached = await self.redis.get(self.key(user_id))
+        if cached:
+            cached = json.loads(cached)
+            # a plain list is an entry of the previous format, due a refresh
+            if isinstance(cached, list):
+                cached = {'ids': cached, 'fetched_at': 0}
+
+            if time.time() - cached['fetched_at'] <= self.soft_ttl:
+                return cached['ids']
+
+            ids = await self._wait(self._refresh_in_background(user_id), self.budget)
+            return cached['ids'] if ids is None else ids
+
+        # nothing to fall back on, an unfiltered page would show blocked users
+        return await self._wait(self._refresh_in_background(user_id), self.timeout)
+
+    async def _wait(self, refresh: asyncio.Task, timeout: float) -> Optional[List[str]]:
+        try:
+            return await asyncio.wait_for(asyncio.shield(refresh), timeout)
+        except Exception:
+            # a late refresh goes on and fills the cache for the next request, 
+            # a failed one is logged by _done
+            return None
+
+    def _refresh_in_background(self, user_id: str) -> asyncio.Task:
+        task = asyncio.ensure_future(
+            single_flight.do(('request-blocked-users', str(user_id)), lambda: self._fetch(user_id))
+        )
+        self.refreshing.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self.refreshing.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f'blocklist refresh failed: {task.exception()}')
+
+    async def _fetch(self, user_id: str) -> Optional[List[str]]:
+        if not self.breaker.allow():
+            return None
+
+        try:
+            reply = await user_rpc.call('request-blocked-users', user_id, timeout=self.timeout)
+        except Exception:
+            self.breaker.failure()
+            raise
+
+        # no reply in time counts against the user service, an error status does not
+        if reply is None:
+            self.breaker.failure()
+            return None
+
+        self.breaker.success()
+        ids = _parse_blocked_users(reply)
+        if ids is None:
+            return None
+
+        await self.redis.setex(
+            self.key(user_id), 
+            self.hard_ttl, 
+            json.dumps({'ids': ids, 'fetched_at': time.time()})
+        )
+        return ids
+
+
+blocklists = BlocklistProvider(
+    soft_ttl=float(os.environ.get('BLOCKLIST_SOFT_TTL', 60*15)),
+    hard_ttl=int(os.environ.get('BLOCKLIST_HARD_TTL', 60*60*24)),
+    budget=float(os.environ.get('BLOCKLIST_BUDGET_MS', 150)) / 1000,
+    timeout=float(os.environ.get('BLOCKLIST_RPC_TIMEOUT', 5)),
+    breaker=CircuitBreaker(
+        'user-service-blocklist',
+        max_failures=int(os.environ.get('BLOCKLIST_BREAKER_FAILURES', 5)),
+        reset_timeout=float(os.environ.get('BLOCKLIST_BREAKER_RESET', 30)),
+    ),
+)
+
+
+async def get_blocked_users(user_id: str) -> Optional[List[str]]:
+    """Ids of users blocked by or blocking the user, None when the user service didn't answer"""
+    return await blocklists.get(user_id)
+
+
+async def get_followers(user_id: str) -> Optional[List[str]]:
+    """Follower ids of the user, None when the user service didn't answer"""
+    if social_graph.LOCAL:
+        return await social_graph.get_followers(user_id)
+
+    return await _lookup(
+        'request-followers', user_id, f'followers:{user_id}', 
+        FOLLOWERS_TTL, _parse_followers,
+    )
+
+
+async def require_followers(user_id: str) -> List[str]:
+    """Follower ids of the user, raises when they are not known (the caller is retried)"""
+    follower_ids = await get_followers(user_id)
+    if follower_ids is None:
+        raise RuntimeError(f'followers of {user_id} are unknown, the user service did not answer')
+
+    return follower_ids
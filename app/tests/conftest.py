@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from typing import Any
 from typing import Generator
 
@@ -5,7 +6,8 @@ import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import NullPool
 
 import sys
 import os
@@ -16,14 +18,25 @@ os.environ['ENVIRONMENT'] = 'test'
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import your actual models and Base from your project
-from db.database import Base, db as get_db  # Assuming you have Base defined in your db.database
+from db.database import Base, db as get_db, read_db  # Assuming you have Base defined in your db.database
 from main import app as main_app
+from core.outbox import outbox_relay
+from core.communications import FollowersRequestManager, FollowersResponseManager, UserServiceClient
+from core.transport import InMemoryBroker, InMemoryTransport, ScriptedResponder
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_db.sqlite3"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-SessionTesting = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# routes run on AsyncSession, each TestClient runs its own event loop 
+# so connections are not pooled between them
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test_db.sqlite3", poolclass=NullPool
+)
+SessionTesting = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession
+)
 
 # use "function" to renew the db on each test
 # use "session" to keep the db for the whole test
@@ -39,43 +52,57 @@ def app() -> Generator[FastAPI, Any, None]:
     yield _app
     Base.metadata.drop_all(bind=engine)
 
-@pytest.fixture(scope="module")
-def db_session(app: FastAPI) -> Generator[Session, Any, None]:
-    """
-    Creates a fresh database session for a test.
-    """
-    connection = engine.connect()
-    transaction = connection.begin()
-    session = SessionTesting(bind=connection)
-    
-    try:
-        yield session
-    finally:
-        session.close()
-        transaction.rollback()
-        connection.close()
-
-
 @pytest.fixture(scope="function")
 def client(
-    app: FastAPI, db_session: Session
+    app: FastAPI
 ) -> Generator[TestClient, Any, None]:
     """
-    Create a new FastAPI TestClient that uses the `db_session` fixture to override
+    Create a new FastAPI TestClient that uses `SessionTesting` to override
     the `get_db` dependency that is injected into routes.
     """
     
-    def override_get_db():
-        try:
-            yield db_session
-        finally:
-            pass
+    async def override_get_db():
+        async with SessionTesting() as session:
+            yield session
     
     # Override the get_db dependency
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[read_db] = override_get_db
+    # the outbox relay drains the test database too
+    outbox_relay.session_factory = SessionTesting
     
     with TestClient(app) as client:
         yield client
     
     # Clear overrides after test
-    app.dependency_overrides.clear()
\ No newline at end of file
+    app.dependency_overrides.clear()
+
+
+@asynccontextmanager
+async def scripted_user_service(
+    transport=InMemoryTransport, codec=None, batching: bool = False, max_keys: int = 100, **script
+):
+    """
+    A UserServiceClient answered by a ScriptedResponder (`script` is its data) 
+    on an in memory broker, yields (client, responder)
+    """
+    broker = InMemoryBroker()
+    responder = ScriptedResponder(broker, **script)
+    responses = FollowersResponseManager(transport=InMemoryTransport(broker))
+    requests = FollowersRequestManager(
+        transport=transport(broker), responses=responses, **({'codec': codec} if codec else {}),
+    )
+    managers = (responder, requests, responses)
+    for manager in managers:
+        await manager.startup()
+
+    try:
+        yield UserServiceClient(requests, responses, batching=batching, max_keys=max_keys), responder
+    finally:
+        for manager in managers:
+            await manager.shutdown()
+
+@pytest.fixture
+def user_service_stub():
+    """scripted_user_service, for tests that run their own event loop"""
+    return scripted_user_service
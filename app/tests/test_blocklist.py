@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+
+import fakeredis
+import pytest
+
+from core import breaker as breaker_module
+from core.breaker import CircuitBreaker
+from services import user_service
+from services.user_service import BlocklistProvider
+
+# circuit breaker and stale-while-revalidate blocklists, the user service is 
+# a scripted responder on an in memory broker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker_module.time, 'monotonic', clock)
+    return clock
+
+def test_breaker_opens_after_max_failures(clock):
+    breaker = CircuitBreaker('test', max_failures=2, reset_timeout=30)
+
+    breaker.failure()
+    assert breaker.state == 'closed' and breaker.allow()
+
+    breaker.failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+def test_breaker_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker('test', max_failures=1, reset_timeout=30)
+    breaker.failure()
+
+    clock.now += 30
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+def test_breaker_reopens_when_trial_fails(clock):
+    breaker = CircuitBreaker('test', max_failures=1, reset_timeout=30)
+    breaker.failure()
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.failure()
+
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+@pytest.fixture
+def run_blocklists(monkeypatch, user_service_stub):
+    def run(lookups, latency: float = 0, timeout: float = 1, breaker: CircuitBreaker = None, cache: dict = None):
+        """Runs lookups(provider) against a scripted user service, returns (result, requests sent)"""
+        async def main():
+            async with user_service_stub(
+                blocked_users={'u1': ['u2']},
+                blocked_by_users={'u1': ['u3']},
+                latency=lambda: latency,
+            ) as (client, responder):
+                monkeypatch.setattr(user_service, 'user_rpc', client)
+
+                provider = BlocklistProvider(
+                    soft_ttl=60, hard_ttl=600, budget=0.05, timeout=timeout, 
+                    breaker=breaker or CircuitBreaker('test'),
+                )
+                provider.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+                for key, value in (cache or {}).items():
+                    await provider.redis.set(key, json.dumps(value))
+
+                return await lookups(provider), responder.received
+
+        return asyncio.run(main())
+
+    return run
+
+async def settled(provider):
+    while provider.refreshing:
+        await asyncio.gather(*provider.refreshing)
+
+def test_fresh_hit_is_not_refreshed(run_blocklists):
+    async def lookups(provider):
+        return await provider.get('u1')
+
+    ids, sent = run_blocklists(lookups, cache={
+        'blocked_users:u1': {'ids': ['cached'], 'fetched_at': time.time()},
+    })
+
+    assert ids == ['cached']
+    assert sent == []
+
+def test_stale_hit_refreshes_once_in_background(run_blocklists):
+    async def lookups(provider):
+        first = await asyncio.gather(provider.get('u1'), provider.get('u1'))
+        await settled(provider)
+        return first, await provider.get('u1')
+
+    # the refresh takes longer than the budget
+    (stale, fresh), sent = run_blocklists(lookups, latency=0.2, cache={
+        'blocked_users:u1': {'ids': ['stale'], 'fetched_at': time.time() - 120},
+    })
+
+    assert stale == [['stale'], ['stale']]
+    assert len(sent) == 1
+    assert fresh == ['u2', 'u3']
+
+def test_stale_hit_refreshed_within_budget(run_blocklists):
+    ids, sent = run_blocklists(lambda provider: provider.get('u1'), cache={
+        'blocked_users:u1': {'ids': ['stale'], 'fetched_at': time.time() - 120},
+    })
+
+    assert ids == ['u2', 'u3']
+    assert len(sent) == 1
+
+def test_old_format_entry_is_served_and_refreshed(run_blocklists):
+    async def lookups(provider):
+        ids = await provider.get('u1')
+        await settled(provider)
+        return ids
+
+    ids, sent = run_blocklists(lookups, latency=0.2, cache={'blocked_users:u1': ['old']})
+
+    assert ids == ['old']
+    assert len(sent) == 1
+
+def test_miss_within_budget(run_blocklists):
+    ids, sent = run_blocklists(lambda provider: provider.get('u1'))
+
+    assert ids == ['u2', 'u3']
+    assert len(sent) == 1
+
+def test_miss_past_budget_waits_for_the_user_service(run_blocklists):
+    async def lookups(provider):
+        return await provider.get('u1'), await provider.get('u1')
+
+    (missed, cached), sent = run_blocklists(lookups, latency=0.2)
+
+    # nothing cached, an unfiltered page is not an option
+    assert missed == ['u2', 'u3']
+    assert cached == ['u2', 'u3']
+    assert len(sent) == 1
+
+def test_miss_past_timeout_returns_none(run_blocklists):
+    async def lookups(provider):
+        ids = await provider.get('u1')
+        await settled(provider)
+        return ids
+
+    ids, sent = run_blocklists(lookups, latency=0.2, timeout=0.1)
+
+    assert ids is None
+    assert len(sent) == 1
+
+def test_open_breaker_skips_the_user_service(run_blocklists):
+    breaker = CircuitBreaker('test', max_failures=1)
+    breaker.failure()
+
+    ids, sent = run_blocklists(lambda provider: provider.get('u1'), breaker=breaker)
+
+    assert ids is None
+    assert sent == []
@@ -0,0 +1,305 @@
+import asyncio
+import time
+import pytest
+import uuid
+
+from core.communications import (
+    INSTANCE_ID,
+    REPLY_TO_HEADER,
+    FollowersResponseManager,
+)
+from core.transport import InMemoryTransport, Message, Transport
+from core.codecs import CODECS, COMPRESSIONS, Codec, MessageCodec
+
+# runs without kafka, an in memory broker and a scripted responder stand in 
+# for kafka and the user service
+
+
+class RPC:
+    def __init__(self, user_service, batching: bool, max_keys: int = 100, codec: MessageCodec = None, transport=InMemoryTransport, **script):
+        self.user_service = user_service
+        self.batching = batching
+        self.transport = transport
+        self.max_keys = max_keys
+        self.codec = codec or MessageCodec()
+        self.script = script
+        self.responder = None
+
+    def run(self, lookups):
+        async def main():
+            async with self.user_service(
+                transport=self.transport,
+                codec=self.codec,
+                batching=self.batching,
+                max_keys=self.max_keys,
+                followers={'u1': ['u2', 'u3'], 'u2': ['u1']},
+                blocked_users={'u1': ['u4']},
+                blocked_by_users={'u1': ['u5']},
+                **self.script,
+            ) as (client, self.responder):
+                return await lookups(client)
+
+        return asyncio.run(main())
+
+    @property
+    def sent(self):
+        return self.responder.received
+
+
+@pytest.fixture
+def rpc(user_service_stub):
+    return lambda **options: RPC(user_service_stub, **options)
+
+def test_single_request(rpc):
+    stub = rpc(batching=False)
+
+    response = stub.run(lambda client: client.call('request-followers', 'u1', timeout=1))
+
+    assert response['followers'] == ['u2', 'u3']
+    assert len(stub.sent) == 1
+
+def test_batched_requests_share_one_message(rpc):
+    stub = rpc(batching=True)
+
+    async def lookups(client):
+        return await asyncio.gather(*[
+            client.call('request-followers', user_id, timeout=1) 
+            for user_id in ('u1', 'u2', 'u3')
+        ])
+
+    responses = stub.run(lookups)
+
+    assert [r['followers'] for r in responses] == [['u2', 'u3'], ['u1'], []]
+    assert len(stub.sent) == 1
+    assert stub.sent[0][1]['user_ids'] == ['u1', 'u2', 'u3']
+
+def test_batches_split_by_topic(rpc):
+    stub = rpc(batching=True)
+
+    async def lookups(client):
+        return await asyncio.gather(
+            client.call('request-followers', 'u1', timeout=1),
+            client.call('request-blocked-users', 'u1', timeout=1),
+        )
+
+    followers, blocked = stub.run(lookups)
+
+    assert followers['followers'] == ['u2', 'u3']
+    assert blocked['blocked_users'] + blocked['blocked_by_users'] == ['u4', 'u5']
+    assert len(stub.sent) == 2
+
+def test_batch_sent_at_max_keys(rpc):
+    stub = rpc(batching=True, max_keys=2)
+
+    async def lookups(client):
+        return await asyncio.gather(*[
+            client.call('request-followers', f'user-{i}', timeout=1) for i in range(5)
+        ])
+
+    responses = stub.run(lookups)
+
+    assert len(responses) == 5
+    assert [len(value['user_ids']) for _, value in stub.sent] == [2, 2, 1]
+
+def test_unknown_topic(rpc):
+    stub = rpc(batching=True)
+
+    response = stub.run(lambda client: client.call('request-anything', 'u1', timeout=1))
+
+    assert response is None
+    assert stub.sent == []
+
+def test_response_before_waiter():
+    response_manager = FollowersResponseManager()
+    response_manager._resolve('id-1', {'followers': []})
+
+    response = asyncio.run(response_manager.wait_for_response('id-1', timeout=1))
+
+    assert response == {'followers': []}
+    assert not response_manager.unclaimed
+
+def test_requests_carry_reply_to(rpc):
+    stub = rpc(batching=False)
+
+    stub.run(lambda client: client.call('request-followers', 'u1', timeout=1))
+
+    assert stub.sent[0][1]['reply_to'] == INSTANCE_ID
+
+def test_replies_of_other_instances_skipped():
+    response_manager = FollowersResponseManager()
+
+    # not valid json, it must not be decoded
+    response_manager._handle(b'id-1', [(REPLY_TO_HEADER, b'other-instance')], b'not json')
+    response_manager._handle(b'id-2', [(REPLY_TO_HEADER, INSTANCE_ID.encode())], b'{"followers": []}')
+    response_manager._handle(b'id-3', [], b'{"followers": []}')
+
+    assert list(response_manager.unclaimed) == ['id-2', 'id-3']
+
+def test_dropped_request_times_out(rpc):
+    stub = rpc(batching=False, drop_rate=1)
+
+    response = stub.run(lambda client: client.call('request-followers', 'u1', timeout=0.05))
+
+    assert response is None
+    assert stub.responder.dropped == 1
+
+def test_generated_follower_list(rpc):
+    stub = rpc(batching=False, follower_count=5000, latency=lambda: 0.01)
+
+    response = stub.run(lambda client: client.call('request-followers', 'someone', timeout=1))
+
+    assert len(response['followers']) == 5000
+
+@pytest.mark.parametrize('codec', sorted(CODECS))
+@pytest.mark.parametrize('compression', [None, *sorted(COMPRESSIONS)])
+def test_codec_round_trip(codec, compression):
+    message_codec = MessageCodec(codec, compression, min_compress_size=0)
+    message = {
+        'request_id': 'id-1',
+        'followers': [str(uuid.uuid4()) for _ in range(100)],
+        'results': {'u1': {'blocked_users': [str(uuid.uuid4())], 'blocked_by_users': ['not-a-uuid']}},
+    }
+
+    value, headers = message_codec.encode(message)
+
+    assert MessageCodec.decode(value, headers) == message
+
+def test_replies_in_request_format(rpc):
+    codec = 'msgpack' if 'msgpack' in CODECS else 'json'
+    stub = rpc(batching=True, codec=MessageCodec(codec, min_compress_size=0), follower_count=1000)
+
+    async def lookups(client):
+        return await asyncio.gather(
+            client.call('request-followers', 'u1', timeout=1),
+            client.call('request-followers', 'someone', timeout=1),
+        )
+
+    followers, generated = stub.run(lookups)
+
+    assert followers['followers'] == ['u2', 'u3']
+    assert len(generated['followers']) == 1000
+
+class UndeliverableTransport(InMemoryTransport):
+    """Queues without complaint, the delivery fails afterwards"""
+
+    async def enqueue(self, topic, key, value, headers=()):
+        delivery = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().call_soon(delivery.set_exception, ConnectionError('broker down'))
+        return delivery
+
+def test_delivery_failure_reaches_waiter(rpc):
+    stub = rpc(batching=False, transport=UndeliverableTransport)
+
+    async def lookup(client):
+        with pytest.raises(ConnectionError):
+            await client.call('request-followers', 'u1', timeout=5)
+
+    stub.run(lookup)
+
+def test_producer_metrics(rpc):
+    stub = rpc(batching=False)
+
+    async def lookups(client):
+        await asyncio.gather(*[client.call('request-followers', 'u1', timeout=1) for _ in range(3)])
+        return client.request_manager.transport.metrics.snapshot()
+
+    metrics = stub.run(lookups)
+
+    assert metrics['messages'] == 3
+    assert metrics['in_flight'] == 0
+    assert metrics['failed'] == 0
+
+def test_unknown_format_raises():
+    with pytest.raises(ValueError):
+        MessageCodec.decode(b'{}', [('content-type', b'cbor')])
+    with pytest.raises(ValueError):
+        MessageCodec.decode(b'{}', [('content-encoding', b'brotli')])
+
+def test_undecodable_reply_keeps_consumer_running(rpc):
+    stub = rpc(batching=False)
+
+    async def lookups(client):
+        broker = client.request_manager.transport.broker
+        for headers in ([('content-type', b'cbor')], [('content-encoding', b'brotli')], []):
+            broker.publish(Message(
+                'response-followers', b'bad', b'not json', 
+                (*headers, (REPLY_TO_HEADER, INSTANCE_ID.encode())),
+            ))
+        await asyncio.sleep(0)
+        return await client.call('request-followers', 'u1', timeout=1)
+
+    response = stub.run(lookups)
+
+    assert response['followers'] == ['u2', 'u3']
+
+def best_of(fn, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+@pytest.mark.parametrize('codec', sorted(set(CODECS) - {'json'}))
+def test_follower_reply_decodes_no_slower_than_json(codec):
+    # the follower-response path is what the codecs are for, 
+    # see benchmarks/codec_benchmark.py for the full table
+    message = {'request_id': 'id-1', 'status': '200', 'followers': [str(uuid.uuid4()) for _ in range(50000)]}
+    json_value, json_headers = MessageCodec('json').encode(message)
+    value, headers = MessageCodec(codec).encode(message)
+
+    json_decode = best_of(lambda: MessageCodec.decode(json_value, json_headers))
+    decode = best_of(lambda: MessageCodec.decode(value, headers))
+
+    # generous, timings of a shared machine are noisy
+    assert decode < json_decode * 2
+
+@pytest.mark.skipif('msgpack' not in CODECS, reason='msgpack is not installed')
+def test_packed_uuid_lists_are_still_read():
+    import msgpack
+    from core.codecs import UUID_LIST_EXT
+
+    ids = [str(uuid.uuid4()) for _ in range(3)]
+    value = msgpack.packb(
+        {'followers': msgpack.ExtType(UUID_LIST_EXT, b''.join(uuid.UUID(pk).bytes for pk in ids))}, 
+        use_bin_type=True,
+    )
+
+    assert MessageCodec.decode(value, [('content-type', b'msgpack')]) == {'followers': ids}
+
+def test_incomplete_transport_or_codec_cannot_be_created():
+    class SendOnly(Transport):
+        async def start_producer(self):
+            pass
+
+        async def enqueue(self, topic, key, value, headers=()):
+            pass
+
+    class DumpsOnly(Codec):
+        name = 'dumps-only'
+
+        def dumps(self, obj) -> bytes:
+            return b''
+
+    with pytest.raises(TypeError):
+        SendOnly()
+    with pytest.raises(TypeError):
+        DumpsOnly()
+
+def test_batch_callers_keep_their_own_timeouts(rpc):
+    stub = rpc(batching=True, latency=lambda: 0.2)
+
+    async def lookups(client):
+        async def timed(user_id, timeout):
+            start = time.perf_counter()
+            reply = await client.call('request-followers', user_id, timeout=timeout)
+            return reply, time.perf_counter() - start
+
+        return await asyncio.gather(timed('u1', 0.05), timed('u2', 1))
+
+    (impatient, impatient_took), (patient, _) = stub.run(lookups)
+
+    # the first caller's short timeout is not the batch's
+    assert impatient is None and impatient_took < 0.15
+    assert patient['followers'] == ['u1']
+    assert len(stub.sent) == 1
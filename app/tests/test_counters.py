@@ -0,0 +1,128 @@
+import asyncio
+import uuid
+
+import fakeredis
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from db.database import Base
+from models.post import Post
+from core import counters
+from core.counters import ViewCounter
+
+# write-behind views on fakeredis and a sqlite database
+
+
+@pytest.fixture
+def views(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/views.sqlite3")
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+    monkeypatch.setattr(counters, 'SessionLocal', sessions)
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    asyncio.run(create())
+
+    counter = ViewCounter(batch_size=2)
+    counter.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    yield counter
+
+    asyncio.run(engine.dispose())
+
+async def add_posts(*views):
+    async with counters.SessionLocal() as db:
+        posts = [Post(user_id=uuid.uuid4(), file_path='x', caption='x', views=v) for v in views]
+        db.add_all(posts)
+        await db.commit()
+    return [post.id for post in posts]
+
+async def stored_views(post_ids):
+    async with counters.SessionLocal() as db:
+        views = dict((await db.execute(select(Post.id, Post.views).where(Post.id.in_(post_ids)))).all())
+    return [views[pk] for pk in post_ids]
+
+async def load(counter, post_ids):
+    async with counters.SessionLocal() as db:
+        posts = (await db.scalars(select(Post).where(Post.id.in_(post_ids)))).all()
+        await counter.merge(posts)
+        views = {post.id: post.views for post in posts}
+        dirty = any(post in db.dirty for post in posts)
+    return [views[pk] for pk in post_ids], dirty
+
+def test_flush_adds_pending_views_in_batches(views):
+    async def main():
+        post_ids = await add_posts(0, 10, None, 5, 0)
+        # 5 posts, batches of 2
+        for pk, count in zip(post_ids, (1, 2, 3, 4, 0)):
+            for _ in range(count):
+                await views.incr(pk)
+
+        await views.flush()
+        return (
+            await stored_views(post_ids),
+            await views.redis.exists(views.PENDING_KEY, views.FLUSHING_KEY),
+        )
+
+    stored, left = asyncio.run(main())
+
+    assert stored == [1, 12, 3, 9, 0]
+    assert left == 0
+
+def test_views_counted_during_a_flush_wait_for_the_next(views, monkeypatch):
+    async def main():
+        [post_id] = await add_posts(0)
+        await views.incr(post_id)
+
+        hgetall = views.redis.hgetall
+
+        async def counted_meanwhile(key):
+            # the pending hash was renamed away, this goes to a new one
+            await views.incr(post_id)
+            return await hgetall(key)
+
+        monkeypatch.setattr(views.redis, 'hgetall', counted_meanwhile)
+        await views.flush()
+        monkeypatch.setattr(views.redis, 'hgetall', hgetall)
+        first = await stored_views([post_id])
+
+        await views.flush()
+        return first, await stored_views([post_id])
+
+    first, second = asyncio.run(main())
+
+    assert first == [1]
+    assert second == [2]
+
+def test_leftover_flushing_hash_is_finished_first(views):
+    async def main():
+        [post_id] = await add_posts(0)
+        # a flush that died before its UPDATE
+        await views.redis.hset(views.FLUSHING_KEY, str(post_id), 3)
+        await views.incr(post_id)
+
+        await views.flush()
+        first = await stored_views([post_id])
+        await views.flush()
+        return first, await stored_views([post_id])
+
+    first, second = asyncio.run(main())
+
+    assert first == [3]
+    assert second == [4]
+
+def test_merge_adds_pending_and_flushing_views(views):
+    async def main():
+        post_ids = await add_posts(10, 20, 30)
+        await views.redis.hset(views.FLUSHING_KEY, str(post_ids[0]), 2)
+        await views.redis.hset(views.FLUSHING_KEY, str(post_ids[1]), 3)
+        await views.incr(post_ids[1])
+
+        return await load(views, post_ids)
+
+    loaded, dirty = asyncio.run(main())
+
+    assert loaded == [12, 24, 30]
+    # merged views are not written back with the post
+    assert not dirty
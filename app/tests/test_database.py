@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy import text, DateTime
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from db import database
+from db.database import ReplicaSet, read_from_primary
+from models import post, interaction, graph, outbox  # noqa: F401, registers the tables
+
+# read routing of db/database.py, every "database" is a sqlite file 
+# holding its own name
+
+
+def setup_databases(tmp_path, monkeypatch, replica_count: int = 2):
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/primary.sqlite3")
+    replicas = [
+        create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/replica-{i}.sqlite3")
+        for i in range(replica_count)
+    ]
+
+    async def create():
+        for name, engine in [('primary', primary), *((f'replica-{i}', e) for i, e in enumerate(replicas))]:
+            async with engine.begin() as conn:
+                await conn.execute(text("CREATE TABLE source (name TEXT)"))
+                await conn.execute(text("INSERT INTO source VALUES (:name)"), {"name": name})
+    asyncio.run(create())
+
+    monkeypatch.setattr(database, 'engine', primary)
+    monkeypatch.setattr(database, 'replicas', ReplicaSet(replicas, cooldown=30))
+
+def read_sources(session_info: dict, reads: int, primary_after: int = None):
+    async def main():
+        async with database.SessionLocal(info=session_info) as session:
+            sources = []
+            for i in range(reads):
+                if i == primary_after:
+                    read_from_primary(session)
+                sources.append((await session.execute(text("SELECT name FROM source"))).scalar())
+            return sources
+
+    return asyncio.run(main())
+
+def test_read_session_sticks_to_one_replica(tmp_path, monkeypatch):
+    setup_databases(tmp_path, monkeypatch)
+
+    sources = read_sources({'read_only': True}, reads=4)
+
+    assert len(set(sources)) == 1
+    assert sources[0].startswith('replica')
+
+def test_read_sessions_spread_over_replicas(tmp_path, monkeypatch):
+    setup_databases(tmp_path, monkeypatch)
+
+    sources = {read_sources({'read_only': True}, reads=1)[0] for _ in range(4)}
+
+    assert sources == {'replica-0', 'replica-1'}
+
+def test_read_from_primary(tmp_path, monkeypatch):
+    setup_databases(tmp_path, monkeypatch)
+
+    sources = read_sources({'read_only': True}, reads=3, primary_after=1)
+
+    assert sources[0].startswith('replica')
+    assert sources[1:] == ['primary', 'primary']
+
+def test_write_sessions_use_primary(tmp_path, monkeypatch):
+    setup_databases(tmp_path, monkeypatch)
+
+    assert read_sources({}, reads=2) == ['primary', 'primary']
+
+
+def test_datetime_defaults_are_naive_utc():
+    # asyncpg refuses aware values for timestamp without time zone columns
+    columns = [
+        column for table in database.Base.metadata.tables.values() for column in table.columns
+        if isinstance(column.type, DateTime) and not column.type.timezone and column.default is not None
+    ]
+    assert {'posts.created_at', 'user_references.synced_at', 'follows.created_at'} <= {
+        f'{column.table.name}.{column.name}' for column in columns
+    }
+
+    for column in columns:
+        # a callable, not a value computed at import
+        assert column.default.is_callable, column
+        value = column.default.arg(None)
+        assert value.tzinfo is None, column
+        assert abs((value - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()) < 5, column
+
+
+def test_dispose_closes_every_replica_pool(tmp_path, monkeypatch):
+    setup_databases(tmp_path, monkeypatch, replica_count=2)
+    engines = database.replicas.engines
+
+    async def main():
+        for replica in engines:
+            async with replica.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        pools = [replica.pool for replica in engines]
+        opened = [pool.checkedin() for pool in pools]
+
+        await database.replicas.dispose()
+        return opened, [pool.checkedin() for pool in pools]
+
+    opened, after = asyncio.run(main())
+
+    assert opened == [1, 1]
+    assert after == [0, 0]
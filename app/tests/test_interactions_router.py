@@ -1,8 +1,20 @@
+import asyncio
 import json
 import pytest
 import requests
 import uuid
 
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from core import background_tasks
+from core.oauth import get_current_user
+from db.database import Base, db as get_db
+from models.post import Post
+from routers import interactions as interactions_router
+
 
 user_emails = ["test.1001@gmail.com", "test.1002@gmail.com", "test.1003@gmail.com"]
 user_password = "123456"
@@ -1039,3 +1051,90 @@ def test_user_bookmarks_bad_authentication(client):
     assert res_data['detail'] == 'Invalid token'
 
 
+# denormalized post counters, on a sqlite database without the user service
+
+@pytest.fixture
+def counters_db(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/counters.sqlite3")
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    asyncio.run(create())
+
+    async def invalidate_user_stats(*user_ids):
+        pass
+    monkeypatch.setattr(interactions_router, 'invalidate_user_stats', invalidate_user_stats)
+    monkeypatch.setattr(background_tasks, 'SessionLocal', sessions)
+
+    yield sessions
+    asyncio.run(engine.dispose())
+
+def add_posts(sessions, count: int):
+    async def add():
+        async with sessions() as db:
+            posts = [Post(user_id=uuid.uuid4(), file_path='x', caption='x') for _ in range(count)]
+            db.add_all(posts)
+            await db.commit()
+        return [post.id for post in posts]
+    return asyncio.run(add())
+
+def post_counters(sessions, post_id):
+    async def read():
+        async with sessions() as db:
+            post = await db.get(Post, post_id)
+            return post.likes_count, post.comments_count, post.bookmarks_count
+    return asyncio.run(read())
+
+@pytest.fixture
+def counters_client(counters_db):
+    user = {'id': str(uuid.uuid4())}
+
+    async def session():
+        async with counters_db() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(interactions_router.router)
+    app.dependency_overrides.update({
+        get_db: session, get_current_user: lambda: user['id'],
+    })
+    with TestClient(app) as client:
+        yield client, user
+
+def test_interactions_update_post_counters(counters_db, counters_client):
+    client, user = counters_client
+    [post_id] = add_posts(counters_db, 1)
+    users = [str(uuid.uuid4()) for _ in range(3)]
+
+    for user['id'] in users:
+        assert client.post('/interactions/likes', data={'post_id': str(post_id)}).json() == {'value': 1}
+        assert client.post('/interactions/bookmarks', data={'post_id': str(post_id)}).json() == {'value': 1}
+        comment = client.post('/interactions/comments', data={'post_id': str(post_id), 'comment': 'hi'}).json()
+    assert post_counters(counters_db, post_id) == (3, 3, 3)
+
+    # the last user takes everything back
+    assert client.post('/interactions/likes', data={'post_id': str(post_id)}).json() == {'value': 0}
+    assert client.post('/interactions/bookmarks', data={'post_id': str(post_id)}).json() == {'value': 0}
+    assert client.delete(f"/interactions/comments/{comment['id']}").status_code == 204
+    assert post_counters(counters_db, post_id) == (2, 2, 2)
+
+def test_reconcile_repairs_drifted_counters(counters_db, counters_client):
+    client, user = counters_client
+    # more posts than a batch
+    post_ids = add_posts(counters_db, 3)
+
+    client.post('/interactions/likes', data={'post_id': str(post_ids[0])})
+    client.post('/interactions/bookmarks', data={'post_id': str(post_ids[1])})
+    client.post('/interactions/comments', data={'post_id': str(post_ids[2]), 'comment': 'hi'})
+
+    async def corrupt():
+        async with counters_db() as db:
+            await db.execute(update(Post).values(likes_count=7, comments_count=-1, bookmarks_count=3))
+            await db.commit()
+    asyncio.run(corrupt())
+
+    asyncio.run(background_tasks.reconcile_post_counters(batch_size=2))
+
+    assert [post_counters(counters_db, pk) for pk in post_ids] == [(1, 0, 0), (0, 0, 1), (0, 1, 0)]
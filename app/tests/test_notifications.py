@@ -0,0 +1,361 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core.notifications import NotificationManager, NotificationAggregator, PUBLISH_SCRIPT
+from core.pubsub import PubSubHub
+from core.oauth import get_current_user
+from core.pagination import NEXT_CURSOR_HEADER
+from routers import notifications as notifications_router
+
+# notification inbox, streams and aggregation on fakeredis
+
+
+def make_manager(**options) -> NotificationManager:
+    manager = NotificationManager(**options)
+    manager.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    manager.script = manager.redis.register_script(PUBLISH_SCRIPT)
+    manager.hub = PubSubHub()
+    manager.hub.redis = manager.redis
+    return manager
+
+def event_ids(chunk: str):
+    return [line[4:] for line in chunk.split('\n') if line.startswith('id: ')]
+
+def event_data(chunk: str):
+    return [json.loads(line[6:])['data'] for line in chunk.split('\n') if line.startswith('data: ')]
+
+async def published_ids(manager, user_id):
+    return [event_id for event_id, _ in await manager.redis.xrange(manager.inbox(user_id))]
+
+def test_stream_replays_events_after_last_event_id():
+    async def main():
+        manager = make_manager()
+        for i in range(4):
+            await manager.notify_user('u1', 'post_liked', {'i': i})
+        ids = await published_ids(manager, 'u1')
+
+        stream = manager.generate_message_stream('user_u1', last_event_id=ids[1])
+        try:
+            assert await stream.__anext__() == ": connected\n\n"
+            return ids, await stream.__anext__()
+        finally:
+            await stream.aclose()
+            await manager.hub.shutdown()
+
+    ids, replayed = asyncio.run(main())
+
+    assert event_ids(replayed) == ids[2:]
+    assert [data['i'] for data in event_data(replayed)] == ['2', '3']
+
+def test_replayed_events_are_not_sent_again_live():
+    async def main():
+        manager = make_manager()
+        await manager.notify_user('u1', 'post_liked', {'i': 0})
+        first = (await published_ids(manager, 'u1'))[0]
+
+        stream = manager.generate_message_stream('user_u1', last_event_id=first)
+        try:
+            # subscribed, these arrive live and are in the inbox too
+            await stream.__anext__()
+            await manager.notify_user('u1', 'post_liked', {'i': 1})
+            await manager.notify_user('u1', 'post_liked', {'i': 2})
+            replayed = await stream.__anext__()
+
+            await manager.notify_user('u1', 'post_liked', {'i': 3})
+            live = await asyncio.wait_for(stream.__anext__(), 2)
+            return await published_ids(manager, 'u1'), replayed, live
+        finally:
+            await stream.aclose()
+            await manager.hub.shutdown()
+
+    ids, replayed, live = asyncio.run(main())
+
+    assert event_ids(replayed) == ids[1:3]
+    assert event_ids(live) == ids[3:]
+
+def test_invalid_last_event_id_is_ignored():
+    async def main():
+        manager = make_manager(heartbeat_interval=0.05)
+        await manager.notify_user('u1', 'post_liked', {'i': 0})
+
+        stream = manager.generate_message_stream('user_u1', last_event_id='not-an-id')
+        try:
+            await stream.__anext__()
+            return await stream.__anext__()
+        finally:
+            await stream.aclose()
+            await manager.hub.shutdown()
+
+    assert asyncio.run(main()) == ": ping\n\n"
+
+
+@pytest.fixture
+def history_client(monkeypatch):
+    manager = make_manager()
+    monkeypatch.setattr(notifications_router, 'notifications', manager)
+
+    app = FastAPI()
+    app.include_router(notifications_router.router)
+    app.dependency_overrides[get_current_user] = lambda: 'u1'
+
+    with TestClient(app) as client:
+        yield manager, client
+
+def test_history_pages_with_next_cursor(history_client):
+    manager, client = history_client
+    for i in range(5):
+        client.portal.call(manager.notify_user, 'u1', 'new_comment', {'i': i})
+
+    pages = []
+    cursor = None
+    while True:
+        params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+        response = client.get('/notifications/history', params=params)
+        assert response.status_code == 200
+        pages.append([event['data']['i'] for event in response.json()])
+
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            break
+
+    assert pages == [['4', '3'], ['2', '1'], ['0']]
+
+def test_history_rejects_invalid_cursor(history_client):
+    _, client = history_client
+
+    response = client.get('/notifications/history', params={'cursor': 'abc'})
+
+    assert response.status_code == 400
+
+
+def run_aggregator(events, window: float = 10, max_pending: int = 100, wait: float = 0, shutdown: bool = True):
+    """Adds the (post id, actor id) events for u1, returns the inbox (data of each event) before and after"""
+    async def main():
+        manager = make_manager()
+        aggregator = NotificationAggregator(manager, window=window, max_pending=max_pending)
+
+        for post_id, actor_id in events:
+            await aggregator.add('u1', 'post_liked', post_id, actor_id, {'post_id': post_id, 'liker_id': actor_id})
+        before = await manager.history('u1', 100)
+
+        await asyncio.sleep(wait)
+        if shutdown:
+            await aggregator.shutdown()
+        after = await manager.history('u1', 100)
+
+        # oldest first
+        return [event['data'] for event in reversed(before)], [event['data'] for event in reversed(after)]
+
+    return asyncio.run(main())
+
+def test_first_event_is_sent_right_away():
+    before, after = run_aggregator([('p1', 'a')], shutdown=False)
+
+    assert before == [{'post_id': 'p1', 'liker_id': 'a'}]
+    assert after == before
+
+def test_following_events_are_sent_as_one_when_the_window_closes():
+    events = [('p1', actor) for actor in 'abcde']
+
+    before, after = run_aggregator(events, window=0.05, wait=0.2, shutdown=False)
+
+    assert before == [{'post_id': 'p1', 'liker_id': 'a'}]
+    assert after[1:] == [{'post_id': 'p1', 'liker_id': 'e', 'count': '4', 'latest_actors': 'e,d,c'}]
+
+def test_single_follower_keeps_its_shape():
+    _, after = run_aggregator([('p1', 'a'), ('p1', 'b')], window=0.05, wait=0.2, shutdown=False)
+
+    assert after == [{'post_id': 'p1', 'liker_id': 'a'}, {'post_id': 'p1', 'liker_id': 'b'}]
+
+def test_posts_are_grouped_separately():
+    _, after = run_aggregator([('p1', 'a'), ('p2', 'b'), ('p1', 'c'), ('p2', 'd')])
+
+    assert after == [
+        {'post_id': 'p1', 'liker_id': 'a'},
+        {'post_id': 'p2', 'liker_id': 'b'},
+        {'post_id': 'p1', 'liker_id': 'c'},
+        {'post_id': 'p2', 'liker_id': 'd'},
+    ]
+
+def test_oldest_window_is_closed_when_full():
+    events = [('p1', 'a'), ('p1', 'b'), ('p1', 'c'), ('p2', 'd'), ('p3', 'e')]
+
+    _, after = run_aggregator(events, max_pending=2, wait=0.05, shutdown=False)
+
+    assert after == [
+        {'post_id': 'p1', 'liker_id': 'a'},
+        {'post_id': 'p2', 'liker_id': 'd'},
+        # p1 closed early to open p3's window
+        {'post_id': 'p3', 'liker_id': 'e'},
+        {'post_id': 'p1', 'liker_id': 'c', 'count': '2', 'latest_actors': 'c,b'},
+    ]
+
+def test_shutdown_sends_open_windows():
+    _, after = run_aggregator([('p1', 'a'), ('p1', 'b'), ('p1', 'c')])
+
+    assert after[1:] == [{'post_id': 'p1', 'liker_id': 'c', 'count': '2', 'latest_actors': 'c,b'}]
+
+
+def track_pipelines(manager) -> dict:
+    """Counts the pipelines the manager executes and how many ran at once"""
+    stats = {'executed': 0, 'in_flight': 0, 'max_in_flight': 0}
+    pipeline = manager.redis.pipeline
+
+    def tracked(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def tracked_execute(*args, **kwargs):
+            stats['executed'] += 1
+            stats['in_flight'] += 1
+            stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+            try:
+                await asyncio.sleep(0.01)
+                return await execute(*args, **kwargs)
+            finally:
+                stats['in_flight'] -= 1
+
+        pipe.execute = tracked_execute
+        return pipe
+
+    manager.redis.pipeline = tracked
+    return stats
+
+def test_fan_out_is_sent_in_chunks():
+    async def main():
+        manager = make_manager(chunk_size=2, concurrency=2)
+        stats = track_pipelines(manager)
+        reported = []
+
+        users = [f'u{i}' for i in range(5)]
+        progress = await manager.notify_users(
+            users, 'new_post', {'post_id': 'p1'}, 
+            on_progress=lambda progress: reported.append(progress.sent),
+        )
+        inboxes = [await manager.history(user_id, 10) for user_id in users]
+        return progress, stats, reported, inboxes, manager.fan_outs
+
+    progress, stats, reported, inboxes, fan_outs = asyncio.run(main())
+
+    assert stats['executed'] == 3
+    assert stats['max_in_flight'] == 2
+    assert reported == [2, 4, 5]
+    assert (progress.total, progress.sent, progress.failed) == (5, 5, 0)
+    assert progress.done
+    assert [[event['data'] for event in inbox] for inbox in inboxes] == [[{'post_id': 'p1'}]] * 5
+    # finished fan-outs are not reported by the metrics
+    assert fan_outs == {}
+
+def test_concurrency_is_shared_by_fan_outs():
+    async def main():
+        manager = make_manager(chunk_size=1, concurrency=1)
+        stats = track_pipelines(manager)
+
+        await asyncio.gather(
+            manager.notify_users(['u1', 'u2'], 'new_post', {}),
+            manager.notify_users(['u3', 'u4'], 'new_post', {}),
+        )
+        return stats
+
+    stats = asyncio.run(main())
+
+    assert stats['executed'] == 4
+    assert stats['max_in_flight'] == 1
+
+def test_failed_chunk_is_reported_with_its_recipients():
+    async def main():
+        manager = make_manager(chunk_size=2)
+        publish = manager._publish
+
+        def failing_publish(user_id, message, client=None):
+            if user_id == 'bad':
+                raise ConnectionError('down')
+            return publish(user_id, message, client=client)
+
+        manager._publish = failing_publish
+        progress = await manager.notify_users(['u1', 'u2', 'u3', 'bad', 'u5'], 'new_post', {})
+        return progress, [await published_ids(manager, user_id) for user_id in ('u1', 'u3', 'u5')]
+
+    progress, published = asyncio.run(main())
+
+    assert (progress.sent, progress.failed) == (3, 2)
+    assert progress.failed_user_ids == ['u3', 'bad']
+    # the other chunks still went out
+    assert [len(ids) for ids in published] == [1, 0, 1]
+
+
+# the process-wide pub/sub connection shared by the streams
+
+async def subscriber_counts(redis, *channels):
+    return [count for _, count in await redis.pubsub_numsub(*channels)]
+
+async def next_message(queue):
+    return await asyncio.wait_for(queue.get(), 1)
+
+def test_listeners_of_a_channel_share_one_subscription():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        hub = PubSubHub()
+        hub.redis = redis
+        try:
+            first = await hub.subscribe('a')
+            second = await hub.subscribe('a')
+            other = await hub.subscribe('b')
+            # one connection for every channel, subscribed once per channel
+            counts = await subscriber_counts(redis, 'a', 'b')
+            connection = hub.pubsub
+
+            await redis.publish('a', 'to a')
+            await redis.publish('b', 'to b')
+            received = [await next_message(queue) for queue in (first, second, other)]
+
+            hub.unsubscribe('a', first)
+            await asyncio.gather(*hub.unsubscribing)
+            after_one = await subscriber_counts(redis, 'a')
+
+            hub.unsubscribe('a', second)
+            await asyncio.gather(*hub.unsubscribing)
+            after_both = await subscriber_counts(redis, 'a', 'b')
+
+            return counts, connection is hub.pubsub, received, after_one, after_both, hub.snapshot()
+        finally:
+            await hub.shutdown()
+
+    counts, same_connection, received, after_one, after_both, snapshot = asyncio.run(main())
+
+    assert counts == [1, 1]
+    assert same_connection
+    assert received == ['to a', 'to a', 'to b']
+    # the channel stays subscribed while it has a listener
+    assert after_one == [1]
+    assert after_both == [0, 1]
+    assert snapshot == {'channels': 1, 'listeners': 1, 'dropped': 0}
+
+def test_full_queue_drops_its_oldest_message():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        hub = PubSubHub(queue_size=2)
+        hub.redis = redis
+        try:
+            slow = await hub.subscribe('a')
+            fast = await hub.subscribe('a')
+
+            for i in range(3):
+                await redis.publish('a', str(i))
+                if i < 2:
+                    await next_message(fast)
+            await next_message(fast)
+
+            return [slow.get_nowait() for _ in range(slow.qsize())], hub.dropped
+        finally:
+            await hub.shutdown()
+
+    kept, dropped = asyncio.run(main())
+
+    assert kept == ['1', '2']
+    assert dropped == 1
@@ -0,0 +1,199 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from db.database import Base
+from models.outbox import OutboxEvent, utcnow
+from core import outbox
+from core.outbox import OutboxRelay
+from services import user_service
+from core import background_tasks
+from core.notifications import FanOutProgress
+
+# the relay on a sqlite outbox, handlers replaced by recording ones
+
+
+@pytest.fixture
+def relay(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/outbox.sqlite3")
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+
+    asyncio.run(_create(engine))
+
+    relay = OutboxRelay(batch_size=10, retry_delay=5, lease=60)
+    relay.session_factory = sessions
+    yield relay
+
+    asyncio.run(engine.dispose())
+
+async def _create(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+async def add_events(relay, *event_types):
+    async with relay.session_factory() as db:
+        for event_type in event_types:
+            db.add(OutboxEvent(event_type=event_type, payload={}))
+        await db.commit()
+
+async def stored_events(relay):
+    async with relay.session_factory() as db:
+        return (await db.scalars(select(OutboxEvent).order_by(OutboxEvent.id))).all()
+
+def test_handlers_run_outside_the_claim(relay, monkeypatch):
+    async def main():
+        await add_events(relay, 'ok', 'ok')
+        seen = []
+
+        async def handler():
+            # the batch is leased and committed, another drain finds nothing
+            seen.append(await relay.drain())
+
+        monkeypatch.setitem(outbox.HANDLERS, 'ok', handler)
+        drained = await relay.drain()
+        return drained, seen, await stored_events(relay)
+
+    drained, seen, events = asyncio.run(main())
+
+    assert drained == 2
+    assert seen == [0, 0]
+    assert events == []
+
+def test_failed_event_is_rescheduled(relay, monkeypatch):
+    async def main():
+        await add_events(relay, 'ok', 'fails')
+
+        async def ok():
+            pass
+
+        async def fails():
+            raise RuntimeError('down')
+
+        monkeypatch.setitem(outbox.HANDLERS, 'ok', ok)
+        monkeypatch.setitem(outbox.HANDLERS, 'fails', fails)
+        await relay.drain()
+        return await stored_events(relay)
+
+    events = asyncio.run(main())
+
+    assert [event.event_type for event in events] == ['fails']
+    assert events[0].attempts == 1
+    assert 'down' in events[0].last_error
+    assert events[0].available_at > utcnow()
+
+def test_expired_lease_is_claimed_again(relay, monkeypatch):
+    async def main():
+        await add_events(relay, 'ok')
+
+        # a relay that died holding the event
+        relay.lease = -1
+        first, _ = await relay.claim()
+        second, _ = await relay.claim()
+        return first, second
+
+    first, second = asyncio.run(main())
+
+    assert len(first) == len(second) == 1
+    assert second[0].attempts == 2
+
+def test_unknown_and_slow_events_fail_alone(relay, monkeypatch):
+    async def main():
+        await add_events(relay, 'ok', 'slow', 'unknown')
+
+        async def ok():
+            pass
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        monkeypatch.setitem(outbox.HANDLERS, 'ok', ok)
+        monkeypatch.setitem(outbox.HANDLERS, 'slow', slow)
+        relay.handler_timeout = 0.05
+        await relay.drain()
+        return await stored_events(relay)
+
+    events = asyncio.run(main())
+
+    assert [event.event_type for event in events] == ['slow', 'unknown']
+    assert 'took more than' in events[0].last_error
+    assert 'unknown outbox event' in events[1].last_error
+    assert all(event.available_at > utcnow() for event in events)
+
+def test_post_with_unknown_followers_is_retried(relay, monkeypatch):
+    async def main():
+        async with relay.session_factory() as db:
+            db.add(OutboxEvent(
+                event_type='post_created', 
+                payload={'post_id': 'p1', 'author_id': 'a1', 'created_at': 1.0},
+            ))
+            await db.commit()
+
+        async def no_answer(user_id):
+            return None
+
+        monkeypatch.setattr(user_service, 'get_followers', no_answer)
+        await relay.drain()
+        return await stored_events(relay)
+
+    events = asyncio.run(main())
+
+    assert len(events) == 1
+    assert 'followers of a1 are unknown' in events[0].last_error
+
+def test_missed_followers_are_retried_alone(relay, monkeypatch):
+    async def main():
+        async with relay.session_factory() as db:
+            db.add(OutboxEvent(
+                event_type='post_created', 
+                payload={'post_id': 'p1', 'author_id': 'a1', 'created_at': 1.0},
+            ))
+            await db.commit()
+
+        async def followers(user_id):
+            return ['f1', 'f2', 'f3']
+
+        class Timelines:
+            async def fan_out(self, post_id, created_at, user_ids):
+                pass
+
+        down = {'f2'}
+        sent = []
+
+        async def notify_users(user_ids, event_type, data):
+            progress = FanOutProgress(event_type, len(user_ids))
+            for user_id in user_ids:
+                if user_id in down:
+                    progress.failed += 1
+                    progress.failed_user_ids.append(user_id)
+                else:
+                    progress.sent += 1
+                    sent.append(user_id)
+            return progress
+
+        monkeypatch.setattr(user_service, 'get_followers', followers)
+        monkeypatch.setattr(background_tasks, 'timelines', Timelines())
+        monkeypatch.setattr(background_tasks, 'SessionLocal', relay.session_factory)
+        monkeypatch.setattr(background_tasks.notifications, 'notify_users', notify_users)
+
+        await relay.drain()
+        pending = await stored_events(relay)
+
+        # still down, the retry fails again
+        relay.retry_delay = 0
+        await relay.drain()
+        retried = await stored_events(relay)
+
+        down.clear()
+        await relay.drain()
+        return pending, retried, await stored_events(relay), sent
+
+    pending, retried, left, sent = asyncio.run(main())
+
+    assert [(event.event_type, event.payload['follower_ids']) for event in pending] == [
+        ('new_post_notifications', ['f2'])
+    ]
+    assert retried[0].attempts == 1 and '1/1 notifications failed' in retried[0].last_error
+    assert left == []
+    assert sent == ['f1', 'f3', 'f2']
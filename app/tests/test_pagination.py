@@ -0,0 +1,71 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from db.database import Base
+from models.post import Post
+from core.pagination import encode_cursor, decode_cursor, paginate, set_next_cursor, NEXT_CURSOR_HEADER
+
+
+def test_cursor_round_trip():
+    created_at, pk = datetime(2024, 5, 1, 12, 30, 15, 123456), uuid.uuid4()
+
+    cursor = encode_cursor(created_at, pk)
+
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (created_at, pk)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    encode_cursor(datetime(2024, 5, 1), uuid.uuid4())[:-3],
+    encode_cursor(datetime(2024, 5, 1), uuid.uuid4())[::-1],
+])
+def test_tampered_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor)
+
+    assert e.value.status_code == 400
+
+
+def test_pages_of_equal_created_at_have_no_duplicates_or_gaps(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/pagination.sqlite3")
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+
+    now = datetime(2024, 5, 1, 12, 0)
+    # 5 posts share the newest created_at, the page size cuts through them
+    created = [now] * 5 + [now - timedelta(minutes=1)] * 2 + [now - timedelta(minutes=2)]
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async with sessions() as db:
+            posts = [Post(user_id=uuid.uuid4(), file_path='x', caption='x', created_at=at) for at in created]
+            db.add_all(posts)
+            await db.commit()
+            expected = [post.id for post in sorted(posts, key=lambda p: (p.created_at, p.id), reverse=True)]
+
+            pages, cursor = [], None
+            while True:
+                response = Response()
+                stmt = paginate(select(Post.id, Post.created_at), Post.created_at, Post.id, 3, cursor=cursor)
+                rows = set_next_cursor(response, (await db.execute(stmt)).all(), 3)
+                pages.append([row.id for row in rows])
+
+                cursor = response.headers.get(NEXT_CURSOR_HEADER)
+                if not cursor:
+                    break
+
+        await engine.dispose()
+        return pages, expected
+
+    pages, expected = asyncio.run(main())
+
+    assert [len(page) for page in pages] == [3, 3, 2]
+    assert [pk for page in pages for pk in page] == expected
@@ -1006,3 +1006,32 @@ def test_tag_list(client):
     assert response.status_code == 200
     assert len(res_data) > 1
     assert set(res_data[0].keys()).issubset(('id', 'name', 'created_at')), "keys are matched"
+
+def test_feed_without_authorization(client):
+    response = client.get('api/posts/feed')
+
+    assert response.status_code == 401
+
+def test_feed_newest_first(client):
+    get_access_key()
+    headers = {
+        "Authorization": f"Bearer {access_key}",
+    }
+
+    response = client.get('api/posts/feed', headers=headers)
+    res_data = response.json()
+
+    assert response.status_code == 200
+    assert isinstance(res_data, list)
+    created = [post['created_at'] for post in res_data]
+    assert created == sorted(created, reverse=True), "newest first"
+
+def test_feed_bad_limit(client):
+    get_access_key()
+    headers = {
+        "Authorization": f"Bearer {access_key}",
+    }
+
+    response = client.get('api/posts/feed?limit=0', headers=headers)
+
+    assert response.status_code == 422
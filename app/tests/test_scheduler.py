@@ -0,0 +1,44 @@
+import asyncio
+
+import fakeredis
+
+from core.scheduler import PeriodicTaskManager, RENEW_SCRIPT
+
+# two workers sharing a fakeredis server
+
+
+def make_manager(server):
+    manager = PeriodicTaskManager()
+    manager.redis = fakeredis.FakeAsyncRedis(server=server)
+    manager.renew_lock = manager.redis.register_script(RENEW_SCRIPT)
+    return manager
+
+def test_slow_job_never_runs_twice_at_once():
+    running = 0
+    overlaps = 0
+    runs = 0
+
+    async def flush():
+        nonlocal running, overlaps, runs
+        running += 1
+        runs += 1
+        overlaps = max(overlaps, running)
+        # three times the interval
+        await asyncio.sleep(0.3)
+        running -= 1
+
+    async def main():
+        server = fakeredis.FakeServer()
+        workers = [make_manager(server) for _ in range(2)]
+        for worker in workers:
+            worker.register(flush, interval=0.1)
+            await worker.startup()
+
+        await asyncio.sleep(1.2)
+        for worker in workers:
+            await worker.shutdown()
+
+    asyncio.run(main())
+
+    assert runs >= 2
+    assert overlaps == 1
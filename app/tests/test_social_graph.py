@@ -0,0 +1,53 @@
+import asyncio
+import uuid
+
+import fakeredis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from db.database import Base
+from models.post import Post
+from models.graph import Follow, Block
+from services import social_graph
+
+# backfill of the local follows/blocks from a scripted user service
+
+author, follower, blocked, blocker, stale = (uuid.uuid4() for _ in range(5))
+
+
+def test_backfill_replaces_author_edges(tmp_path, monkeypatch, user_service_stub):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/graph.sqlite3")
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+    monkeypatch.setattr(social_graph, 'SessionLocal', sessions)
+    monkeypatch.setattr(social_graph, 'redis_client', fakeredis.FakeAsyncRedis())
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async with sessions() as db:
+            db.add(Post(user_id=author, file_path='x', caption='x'))
+            # edges the user service no longer has
+            db.add(Follow(follower_id=stale, followee_id=author))
+            db.add(Block(blocker_id=author, blocked_id=stale))
+            await db.commit()
+
+        async with user_service_stub(
+            followers={str(author): [str(follower)]},
+            blocked_users={str(author): [str(blocked)]},
+            blocked_by_users={str(author): [str(blocker)]},
+        ) as (client, _):
+            monkeypatch.setattr(social_graph, 'user_rpc', client)
+            result = await social_graph.backfill(timeout=1)
+
+        async with sessions() as db:
+            follows = (await db.execute(select(Follow.follower_id, Follow.followee_id))).all()
+            blocks = (await db.execute(select(Block.blocker_id, Block.blocked_id))).all()
+        await engine.dispose()
+        return result, follows, blocks
+
+    result, follows, blocks = asyncio.run(main())
+
+    assert result == {"users": 1, "synced": 1, "failed": 0}
+    assert follows == [(follower, author)]
+    assert sorted(blocks) == sorted([(author, blocked), (blocker, author)])
@@ -1,8 +1,19 @@
 import requests
+import asyncio
 import json
 import pytest
 import uuid
 
+import fakeredis
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from core.cache import get_redis
+from core.oauth import get_current_user
+from db.database import Base, db as get_db, read_db
+from routers import stats as stats_router
+
 user_emails = ["test.1001@gmail.com", "test.1002@gmail.com", "test.1003@gmail.com"]
 user_password = "123456"
 access_key = ''
@@ -64,7 +75,7 @@ def test_stats_valid(client, create_post):
 
     assert response.status_code == 200
     assert res_data['posts'] == 1, 'user must have a post'
-    assert set(res_data.keys()).issubset(('posts', 'views', 'likes', 'comments', 'bookmarks'))
+    assert set(res_data.keys()).issubset(('posts', 'views', 'unique_views', 'likes', 'comments', 'bookmarks'))
 
 
 def test_stats_no_authentication(client):
@@ -76,3 +87,40 @@ def test_stats_no_authentication(client):
 
     assert response.status_code == 401
     assert res_data['detail'] == 'Not authenticated'
+
+def test_stats_are_counted_on_the_primary(tmp_path, monkeypatch):
+    # the stats are cached for the ttl, a lagging replica must not fill the cache
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/primary.sqlite3")
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    asyncio.run(create())
+
+    async def primary():
+        async with sessions() as session:
+            yield session
+
+    async def replica():
+        raise AssertionError('stats read from a replica')
+        yield
+
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    async def fake_redis():
+        yield redis
+
+    async def author_count(user_id):
+        return 0
+    monkeypatch.setattr(stats_router.unique_viewers, 'author_count', author_count)
+
+    app = FastAPI()
+    app.include_router(stats_router.router)
+    app.dependency_overrides.update({
+        get_db: primary, read_db: replica, get_redis: fake_redis, get_current_user: lambda: str(uuid.uuid4()),
+    })
+    with TestClient(app) as client:
+        response = client.get('/stats/')
+
+    assert response.status_code == 200
+    assert response.json()['posts'] == 0
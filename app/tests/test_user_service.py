@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import fakeredis
+
+from services import user_service
+
+# cached, single-flight follower lookups against a scripted user service
+
+
+class CountingRedis(fakeredis.FakeAsyncRedis):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = 0
+
+    async def setex(self, *args, **kwargs):
+        self.writes += 1
+        return await super().setex(*args, **kwargs)
+
+
+def run_lookups(monkeypatch, user_service_stub, lookups):
+    """Runs lookups() with the scripted user service, returns (result, requests sent, cache writes)"""
+    redis = CountingRedis(decode_responses=True)
+    monkeypatch.setattr(user_service, 'redis_client', redis)
+
+    async def main():
+        async with user_service_stub(
+            followers={'u1': ['u2', 'u3'], 'u2': ['u1']},
+            # the first lookup is still in flight when the others arrive
+            latency=lambda: 0.05,
+        ) as (client, responder):
+            monkeypatch.setattr(user_service, 'user_rpc', client)
+            return await lookups(), responder.received, redis
+
+    return asyncio.run(main())
+
+def test_concurrent_lookups_share_one_request(monkeypatch, user_service_stub):
+    async def lookups():
+        return await asyncio.gather(*(user_service.get_followers('u1') for _ in range(10)))
+
+    results, sent, redis = run_lookups(monkeypatch, user_service_stub, lookups)
+
+    assert results == [['u2', 'u3']] * 10
+    assert len(sent) == 1
+    assert redis.writes == 1
+
+def test_lookups_of_different_users_are_not_shared(monkeypatch, user_service_stub):
+    async def lookups():
+        return await asyncio.gather(user_service.get_followers('u1'), user_service.get_followers('u2'))
+
+    results, sent, redis = run_lookups(monkeypatch, user_service_stub, lookups)
+
+    assert results == [['u2', 'u3'], ['u1']]
+    assert len(sent) == 2
+    assert redis.writes == 2
+
+def test_cached_lookup_sends_nothing(monkeypatch, user_service_stub):
+    async def lookups():
+        await user_service.redis_client.set('followers:u1', json.dumps(['cached']))
+        return await asyncio.gather(user_service.get_followers('u1'), user_service.get_followers('u1'))
+
+    results, sent, redis = run_lookups(monkeypatch, user_service_stub, lookups)
+
+    assert results == [['cached'], ['cached']]
+    assert sent == []
+    assert redis.writes == 0